@@ -54,4 +54,57 @@ CREATE TABLE IF NOT EXISTS mod_tempactions(
     PRIMARY KEY ("user_id", "action")
 );
 
-ALTER TABLE mod_tempactions OWNER TO aphid;
\ No newline at end of file
+ALTER TABLE mod_tempactions OWNER TO aphid;
+CREATE TABLE IF NOT EXISTS message_audit(
+    "message_id" BIGINT NOT NULL,
+    "channel_id" BIGINT NOT NULL,
+    "author_id" BIGINT,
+    "action" VARCHAR(16) NOT NULL,
+    "content" VARCHAR(2000),
+    "new_content" VARCHAR(2000),
+    "attachments" TEXT[],
+    "logged" TIMESTAMP NOT NULL
+) PARTITION BY RANGE ("logged");
+
+-- monthly partitions (message_audit_YYYY_MM) are created by the ServerLog cog
+
+CREATE INDEX IF NOT EXISTS message_audit_author_idx ON message_audit ("author_id", "logged");
+CREATE INDEX IF NOT EXISTS message_audit_channel_idx ON message_audit ("channel_id", "logged");
+
+ALTER TABLE message_audit OWNER TO aphid;
+
+CREATE TABLE IF NOT EXISTS invite_joins(
+    "user_id" BIGINT NOT NULL,
+    "invite_code" VARCHAR(32),
+    "candidate_codes" VARCHAR(32)[],
+    "inviter_id" BIGINT,
+    "account_created" TIMESTAMP NOT NULL,
+    "joined" TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS invite_joins_joined_idx ON invite_joins ("joined");
+CREATE INDEX IF NOT EXISTS invite_joins_code_idx ON invite_joins ("invite_code", "joined");
+CREATE INDEX IF NOT EXISTS invite_joins_inviter_idx ON invite_joins ("inviter_id", "joined");
+CREATE INDEX IF NOT EXISTS invite_joins_user_idx ON invite_joins ("user_id", "joined");
+
+ALTER TABLE invite_joins OWNER TO aphid;
+
+CREATE TABLE IF NOT EXISTS member_leaves(
+    "user_id" BIGINT NOT NULL,
+    "left_at" TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS member_leaves_user_idx ON member_leaves ("user_id", "left_at");
+
+ALTER TABLE member_leaves OWNER TO aphid;
+
+CREATE TABLE IF NOT EXISTS voice_sessions(
+    "user_id" BIGINT NOT NULL,
+    "channel_id" BIGINT NOT NULL,
+    "started" TIMESTAMP NOT NULL,
+    "ended" TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS voice_sessions_user_idx ON voice_sessions ("user_id", "started");
+
+ALTER TABLE voice_sessions OWNER TO aphid;
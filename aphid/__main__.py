@@ -28,7 +28,11 @@ def run():
         log.exception('Could not set up PostgreSQL. Exiting.')
         return
 
-    bot = AphidBot(command_prefix=config.cfg['bot']['prefix'], guild_id=config.cfg['bot']['guild'], loop=loop, pool=pool)
+    metrics = config.cfg.get('metrics', {})
+    bot = AphidBot(
+        command_prefix=config.cfg['bot']['prefix'], guild_id=config.cfg['bot']['guild'], loop=loop, pool=pool,
+        metrics_host=metrics.get('host', '127.0.0.1'), metrics_port=metrics.get('port')
+    )
 
     log.info('Starting bot')
 
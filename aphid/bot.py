@@ -1,5 +1,7 @@
+import asyncio
 import datetime
 import logging
+import time
 import traceback
 
 import aiohttp
@@ -7,6 +9,9 @@ import discord
 from discord.ext import commands
 
 from utils import formatting
+from utils.metrics import MetricsServer
+from utils.paginator import PaginatorSessions
+from utils.stats import LatencyStats
 
 log = logging.getLogger(__name__)
 
@@ -18,6 +23,7 @@ initial_extensions = [
     'cogs.meta',
     'cogs.moderation',
     'cogs.owner',
+    'cogs.raiddetector',
     'cogs.serverlog',
     'cogs.stickymessage',
     'cogs.temprole',
@@ -32,8 +38,24 @@ class AphidBot(commands.Bot):
 
         self.pool = kwargs.pop('pool')
         self.guild_id = int(kwargs.pop('guild_id'))
-        self.session = aiohttp.ClientSession(loop=self.loop)
+        self.session = aiohttp.ClientSession(
+            loop=self.loop,
+            # bounded so a slow upstream can't pile up open sockets behind it
+            connector=aiohttp.TCPConnector(limit=32, limit_per_host=4, ttl_dns_cache=300, keepalive_timeout=30, loop=self.loop),
+            timeout=aiohttp.ClientTimeout(total=20, connect=5, sock_read=10)
+        )
         self.initial_extensions = initial_extensions
+        self.paginators = PaginatorSessions(self)
+        self.batch_writers = set()
+        self.latency_stats = LatencyStats()
+        self.stats_path = 'stats.json'
+        self.stats_interval = 60.0
+        self._stats_task = self.loop.create_task(self.write_stats())
+
+        metrics_port = kwargs.pop('metrics_port', None)
+        self.metrics = None
+        if metrics_port is not None:
+            self.metrics = MetricsServer(self, host=kwargs.pop('metrics_host', '127.0.0.1'), port=int(metrics_port))
 
         self.remove_command('help')
 
@@ -46,9 +68,58 @@ class AphidBot(commands.Bot):
                 log.warning(f'Failed to load extension {extension} {ex}.')
 
     async def close(self):
+        self.paginators.close()
+
+        # rows still buffered are written out while the pool is still usable
+        await asyncio.gather(*(writer.close() for writer in list(self.batch_writers)), loop=self.loop)
+
+        self._stats_task.cancel()
+        self.latency_stats.write(self.stats_path)
+        if self.metrics is not None:
+            await self.metrics.close()
         await super().close()
         await self.session.close()
 
+    async def write_stats(self):
+        try:
+            while True:
+                await asyncio.sleep(self.stats_interval)
+                self.latency_stats.write(self.stats_path)
+        except asyncio.CancelledError:
+            pass
+        except Exception as ex:
+            self.loop.call_exception_handler({'exception': ex})
+
+    async def _run_event(self, coro, event_name, *args, **kwargs):
+        # Client._run_event, timing every listener as it goes
+        owner = getattr(coro, '__self__', None)
+        name = f'{type(owner).__name__}.{coro.__name__}' if owner is not None else coro.__name__
+
+        start = time.perf_counter()
+        try:
+            await coro(*args, **kwargs)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            self.latency_stats.record('listener', name, time.perf_counter() - start, error=True)
+            try:
+                await self.on_error(event_name, *args, **kwargs)
+            except asyncio.CancelledError:
+                pass
+        else:
+            self.latency_stats.record('listener', name, time.perf_counter() - start)
+
+    async def invoke(self, ctx):
+        if ctx.command is None:
+            return await super().invoke(ctx)
+
+        start = time.perf_counter()
+        try:
+            await super().invoke(ctx)
+        finally:
+            name = f'{ctx.command.cog_name or "Bot"}.{ctx.command.qualified_name}'
+            self.latency_stats.record('command', name, time.perf_counter() - start, error=getattr(ctx, 'command_failed', False))
+
     async def on_ready(self):
         if not hasattr(self, 'uptime'):
             self.uptime = datetime.datetime.utcnow()
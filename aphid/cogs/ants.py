@@ -1,21 +1,150 @@
+import asyncio
 import logging
+import re
+import time
 
+import aiohttp
 import discord
 from bs4 import BeautifulSoup
 from discord.ext import commands
 
+from utils import formatting
+from utils.cache import TTLCache
+from utils.taxonomy import TaxonomyIndex
+
 log = logging.getLogger(__name__)
 
+_heading = re.compile(rb'<h1[^>]*id="firstHeading".*?</h1>', re.DOTALL)
+_infobox = re.compile(rb'<table[^>]*class="infobox biota"')
+_table_tag = re.compile(rb'<(/?)table\b', re.IGNORECASE)
+
+
+def _extract_table(text, start):
+    depth = 0
+    for match in _table_tag.finditer(text, start):
+        depth += -1 if match.group(1) else 1
+        if depth == 0:
+            return text[start:text.find(b'>', match.end()) + 1]
+    return text[start:]
+
+
+def parse_taxon(text):
+    """Parses the name and classification out of an AntWiki page.
+
+    Only the heading and the taxobox (which holds the classification) are
+    handed to the HTML parser, the rest of the page is never tokenised.
+    """
+    infobox = _infobox.search(text)
+    if infobox is None:
+        return None
+
+    heading = _heading.search(text)
+    fragment = (heading.group(0) if heading is not None else b'') + _extract_table(text, infobox.start())
+    soup = BeautifulSoup(fragment, 'html.parser')
+
+    name = soup.find('h1', id='firstHeading').span.i.text
+
+    infobox = soup.find('table', attrs={'class': 'infobox biota'})
+
+    image = infobox.find('img')
+    image = f'http://antwiki.org{image["src"]}' if image is not None else ''
+
+    subfamily = infobox.find('span', attrs={'class': 'subfamily'})
+    subfamily = subfamily.a.text if subfamily is not None else ''
+
+    tribe = infobox.find('span', attrs={'class': 'tribe'})
+    tribe = tribe.a.text if tribe is not None else ''
+
+    return {'name': name, 'image': image, 'subfamily': subfamily, 'tribe': tribe}
+
 
 class Ants:
     """Ant-related commands."""
 
     def __init__(self, bot):
         self.bot = bot
+        self.not_found_ttl = 86400.0
+        self._cache = TTLCache(maxsize=2048, ttl=86400.0 * 7, path='antwiki_cache.sqlite3')
+        self.cache_flush_interval = 30.0
+        self._inflight = {}
+        self.taxonomy = TaxonomyIndex.from_file()
+        self._flush_task = bot.loop.create_task(self.flush_cache())
+
+    def __unload(self):
+        self._flush_task.cancel()
+        for task in self._inflight.values():
+            task.cancel()
+
+        self._cache.close()
+
+    async def flush_cache(self):
+        try:
+            while True:
+                await asyncio.sleep(self.cache_flush_interval)
+
+                # the sqlite write and commit happen off the loop
+                changes = self._cache.take_changes()
+                if changes is not None:
+                    await self.bot.loop.run_in_executor(None, self._cache.write_changes, changes)
+        except asyncio.CancelledError:
+            pass
+        except Exception as ex:
+            self.bot.loop.call_exception_handler({'exception': ex})
+
+    async def fetch_taxon(self, antwiki_url):
+        async with self.bot.session.get(antwiki_url) as resp:
+            if resp.status >= 500:
+                resp.raise_for_status()
+
+            text = await resp.read()
+
+        # parsing a big page takes long enough to stall the gateway, so keep it off the loop
+        start = time.perf_counter()
+        taxon = await self.bot.loop.run_in_executor(None, parse_taxon, text)
+        log.debug(f'Parsed {antwiki_url} ({len(text)} bytes) in {(time.perf_counter() - start) * 1000:.2f}ms')
+        return taxon
+
+    async def get_taxon(self, antwiki_url, key):
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+
+        # everyone asking for the same page at once waits on a single fetch
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = self.bot.loop.create_task(self.load_taxon(antwiki_url, key))
+
+        # shielded so one caller giving up doesn't cancel the fetch for the rest
+        return await asyncio.shield(task)
+
+    async def load_taxon(self, antwiki_url, key):
+        try:
+            taxon = await self.fetch_taxon(antwiki_url)
+        finally:
+            del self._inflight[key]
+
+        # misses are kept too, but not for as long in case the page gets written
+        self._cache.set(key, taxon, ttl=self.not_found_ttl if taxon is None else None)
+        return taxon
+
+    def not_found(self, name):
+        # the index is only for suggestions, it doesn't know every taxon AntWiki has
+        genus, _, rest = name.partition(' ')
+        if rest and genus not in self.taxonomy:
+            # likely a misspelt genus, so suggest genera and keep the rest as given
+            suggestions = [f'{s} {rest}' for s in self.taxonomy.suggest(genus)]
+        else:
+            suggestions = [s for s in self.taxonomy.suggest(name) if s != name.lower()]
+        if len(suggestions) == 0:
+            return 'Not found.'
+
+        suggestions = [f'*{TaxonomyIndex.display(s)}*' for s in suggestions]
+        return f'Not found. Did you mean {formatting.human_join(suggestions)}?'
 
     @commands.command(description='Bring up some simple info on an ant genus or species.')
     @commands.bot_has_permissions(embed_links=True)
-    @commands.cooldown(1, 5.0)
+    @commands.cooldown(2, 5.0, commands.BucketType.user)
     async def ant(self, ctx, genus: str, species: str=None, subspecies: str=None):
         """Bring up some simple info on an ant genus or species."""
 
@@ -37,36 +166,36 @@ class Ants:
             antwiki_url = f'http://antwiki.org/wiki/{genus}_{species}_{subspecies}'
             antweb_url = f'http://antweb.org/description.do?genus={genus}&species={species}&subspecies={subspecies}&rank=subspecies'
 
-        async with ctx.channel.typing():
-            async with self.bot.session.get(antwiki_url) as resp:
-                text = await resp.read()
-                antwiki_soup = BeautifulSoup(text, 'html.parser')
-
-            error = antwiki_soup.find('table', attrs={'class': 'infobox biota'})
-
-            if error is not None:
-                name = antwiki_soup.find('h1', id='firstHeading').span.i.text
+        key = ' '.join(part for part in (genus, species, subspecies) if part is not None)
 
-                image = antwiki_soup.find('table', attrs={'class': 'infobox biota'}).find('img')
-                image = image['src'] if image is not None else None
-                image = f'http://antwiki.org{image}' if image is not None else ''
-
-                subfamily = antwiki_soup.find('span', attrs={'class': 'subfamily'})
-                subfamily = subfamily.a.text if subfamily is not None else ''
-
-                tribe = antwiki_soup.find('span', attrs={'class': 'tribe'})
-                tribe = tribe.a.text if tribe is not None else ''
+        async with ctx.channel.typing():
+            try:
+                taxon = await self.get_taxon(antwiki_url, key)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return await ctx.send('Could not reach AntWiki, try again later.')
 
+            if taxon is not None:
                 embed = discord.Embed(colour=discord.Colour.green())
-                embed.title = name
-                embed.set_thumbnail(url=image)
-                embed.description = f'**Subfamily:** {subfamily}\n**Tribe:** {tribe}'
+                embed.title = taxon['name']
+                embed.set_thumbnail(url=taxon['image'])
+                embed.description = f'**Subfamily:** {taxon["subfamily"]}\n**Tribe:** {taxon["tribe"]}'
                 embed.add_field(name='AntWiki', value=antwiki_url)
                 embed.add_field(name='AntWeb', value=antweb_url)
 
                 await ctx.send(embed=embed)
             else:
-                await ctx.send('Not found.')
+                await ctx.send(self.not_found(key))
+
+    @commands.command(name='antsearch')
+    @commands.cooldown(2, 5.0, commands.BucketType.user)
+    async def ant_search(self, ctx, *, prefix: str):
+        """Search known ant genera and species by the start of their name."""
+
+        names = self.taxonomy.prefix(prefix, limit=15)
+        if len(names) == 0:
+            return await ctx.send(self.not_found(prefix))
+
+        await ctx.send('\n'.join(f'*{TaxonomyIndex.display(name)}*' for name in names))
 
 
 def setup(bot):
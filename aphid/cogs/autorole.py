@@ -11,11 +11,26 @@ class AutoRole:
         self.role_name = 'Egg'
         self.lobby_channel = 'lobby'
         self.verified_role = 'Ant'
+        self._ids = {}
+        # members known to already hold a role besides @everyone and the verified role
+        self._settled = set()
+
+    def get_role_id(self, guild, name):
+        role = guild.get_role(self._ids.get(name))
+        if role is None or role.name != name:
+            role = discord.utils.get(guild.roles, name=name)
+            if role is None:
+                return None
+            self._ids[name] = role.id
+        return role.id
 
     async def on_message(self, message):
         if message.guild is None:
             return
 
+        if message.author.id in self._settled:
+            return
+
         if message.guild.id != self.bot.guild_id:
             return
 
@@ -26,19 +41,28 @@ class AutoRole:
             return
 
         member = message.author
+        guild = message.guild
 
-        roles = member.roles
-        verified_role = discord.utils.get(message.guild.roles, name=self.verified_role)
-
-        if verified_role in roles:
-            roles.remove(verified_role)
-
-        if len(roles) > 1:
+        verified_id = self.get_role_id(guild, self.verified_role)
+        if any(role.id != guild.id and role.id != verified_id for role in member.roles):
+            self._settled.add(member.id)
             return
 
-        role = discord.utils.get(message.guild.roles, name=self.role_name)
+        role = guild.get_role(self.get_role_id(guild, self.role_name))
 
         await member.add_roles(role, reason='AutoRole')
+        self._settled.add(member.id)
+
+    async def on_member_update(self, before, after):
+        if before.roles != after.roles:
+            self._settled.discard(after.id)
+
+    async def on_member_remove(self, member):
+        self._settled.discard(member.id)
+
+    async def on_guild_role_delete(self, role):
+        # members lose the role without a member update
+        self._settled.clear()
 
 
 def setup(bot):
@@ -3,52 +3,147 @@ import datetime
 import logging
 
 import discord
+from discord.ext import commands
 
-from utils import time
+from utils import formatting, time
+from utils.batch import BatchWriter
 
 log = logging.getLogger(__name__)
 
 
 class JoinLeaveLog:
+    """Member join and invite tracking."""
+
     def __init__(self, bot):
         self.bot = bot
         self.log_channel = 'join-leave-logs'
-        self._invite_cache = []
-        self._task = bot.loop.create_task(self.cache_update())
+        self.join_window = 1.5
+        self.stats_ttl = 60.0
+        self.stats_cache_size = 32
+        self._stats_cache = {}
+        self._joins = BatchWriter(bot, 'invite_joins', ['user_id', 'invite_code', 'candidate_codes', 'inviter_id', 'account_created', 'joined'])
+        self._leaves = BatchWriter(bot, 'member_leaves', ['user_id', 'left_at'])
+        self._invite_cache = {}
+        self._invite_cache_ready = False
+        self._pending_joins = []
+        self._attribute_task = None
+        self._task = bot.loop.create_task(self.init_invite_cache())
 
     def __unload(self):
         self._task.cancel()
+        if self._attribute_task is not None:
+            self._attribute_task.cancel()
+
+        self.bot.loop.create_task(self._joins.close())
+        self.bot.loop.create_task(self._leaves.close())
 
     async def get_invites(self):
         guild = self.bot.get_guild(self.bot.guild_id)
         invites = await guild.invites()
-        return invites
+        return {invite.code: invite for invite in invites}
 
-    async def cache_update(self):
+    async def init_invite_cache(self):
         try:
             await self.bot.wait_until_ready()
-            while not self.bot.is_closed():
-                self._invite_cache = await self.get_invites()
-                await asyncio.sleep(30)
+            self._invite_cache = await self.get_invites()
+            self._invite_cache_ready = True
         except asyncio.CancelledError:
             pass
         except Exception as ex:
             self.bot.loop.call_exception_handler({'exception': ex})
 
+    async def on_invite_create(self, invite):
+        if invite.guild.id != self.bot.guild_id:
+            return
+
+        self._invite_cache[invite.code] = invite
+
+    async def on_invite_delete(self, invite):
+        if invite.guild.id != self.bot.guild_id:
+            return
+
+        # keep it if it was deleted for hitting max uses, the next diff
+        # still needs it to attribute that last join
+        cached = self._invite_cache.get(invite.code)
+        if cached is None or not cached.max_uses or cached.uses + 1 < cached.max_uses:
+            self._invite_cache.pop(invite.code, None)
+
+    def diff_invites(self, invites, joins):
+        # without a baseline every invite that was ever used would look new
+        if not self._invite_cache_ready:
+            return []
+
+        used = []
+        total = 0
+
+        for code, invite in invites.items():
+            cached = self._invite_cache.get(code)
+            previous = cached.uses if cached is not None else 0
+            if invite.uses > previous:
+                used.append(invite)
+                total += invite.uses - previous
+
+        if total >= joins:
+            return used
+
+        # single or limited use invites are deleted once they run out, only
+        # look at those if the surviving invites don't cover the whole burst
+        now = datetime.datetime.utcnow()
+        for code, cached in self._invite_cache.items():
+            if code in invites or not cached.max_uses or cached.uses + 1 < cached.max_uses:
+                continue
+            if cached.max_age and cached.created_at + datetime.timedelta(seconds=cached.max_age) <= now:
+                continue
+            used.append(cached)
+
+        return used
+
     async def attempt_invite_source(self):
-        invites = await self.get_invites()
+        future = self.bot.loop.create_future()
+        self._pending_joins.append(future)
+
+        if self._attribute_task is None:
+            self._attribute_task = self.bot.loop.create_task(self.attribute_joins())
+
+        return await future
+
+    async def attribute_joins(self):
+        pending = []
+        try:
+            # joins that land while a fetch is running are picked up by the
+            # next pass, so only one diff against the cache runs at a time
+            while self._pending_joins:
+                # let a burst of joins land so one fetch covers all of them
+                await asyncio.sleep(self.join_window)
 
-        found_invite = None
+                pending, self._pending_joins = self._pending_joins, []
 
-        for invite in invites:
-            for cached_invite in self._invite_cache:
-                if invite.code == cached_invite.code:
-                    if invite.uses != cached_invite.uses:
-                        found_invite = invite
-                        break
+                try:
+                    invites = await self.get_invites()
+                except Exception as ex:
+                    for future in pending:
+                        if not future.done():
+                            future.set_result([])
+                    pending = []
+                    self.bot.loop.call_exception_handler({'exception': ex})
+                    continue
 
-        self._invite_cache = await self.get_invites()
-        return found_invite
+                used = self.diff_invites(invites, len(pending))
+                self._invite_cache = invites
+                self._invite_cache_ready = True
+
+                for future in pending:
+                    if not future.done():
+                        future.set_result(used)
+                pending = []
+        except asyncio.CancelledError:
+            # joins taken off the queue before the fetch was cancelled are still waiting too
+            for future in pending + self._pending_joins:
+                if not future.done():
+                    future.cancel()
+            self._pending_joins = []
+        finally:
+            self._attribute_task = None
 
     async def on_member_join(self, member):
         if member.guild.id != self.bot.guild_id:
@@ -62,11 +157,24 @@ class JoinLeaveLog:
         if age <= datetime.timedelta(days=7):
             embed.add_field(name='New Account', value=f'Created {time.human_timedelta(age)} ago.', inline=False)
 
-        invite = await self.attempt_invite_source()
-        if invite is not None:
+        invites = await self.attempt_invite_source()
+        if len(invites) == 1:
+            invite = invites[0]
+            inviter_id = invite.inviter.id if invite.inviter is not None else None
+            self._joins.add((member.id, invite.code, None, inviter_id, member.created_at, member.joined_at))
+
             embed.add_field(name='Invite', value=f'{invite.code}', inline=False)
             inviter = f'{str(invite.inviter)} (ID: {invite.inviter.id})' if invite.inviter is not None else 'None'
             embed.add_field(name='Invite Creator', value=inviter, inline=False)
+        elif len(invites) > 1:
+            # keep ambiguous joins with their candidates rather than losing them,
+            # the inviter is still known when every candidate shares one
+            inviters = {invite.inviter.id if invite.inviter is not None else None for invite in invites}
+            inviter_id = inviters.pop() if len(inviters) == 1 else None
+            self._joins.add((member.id, None, [invite.code for invite in invites], inviter_id, member.created_at, member.joined_at))
+
+            codes = formatting.truncate(', '.join(invite.code for invite in invites), 1016)
+            embed.add_field(name='Invite', value=f'One of {codes}', inline=False)
 
         embed.set_footer(text=f'ID: {member.id}')
         embed.timestamp = member.joined_at
@@ -78,6 +186,8 @@ class JoinLeaveLog:
         if member.guild.id != self.bot.guild_id:
             return
 
+        self._leaves.add((member.id, datetime.datetime.utcnow()))
+
         embed = discord.Embed(colour=discord.Colour.red())
         embed.set_author(name='Member Left', icon_url=member.avatar_url)
         embed.description = f'{member.mention} {str(member)}'
@@ -88,6 +198,110 @@ class JoinLeaveLog:
         channel = discord.utils.get(member.guild.channels, name=self.log_channel)
         await channel.send(embed=embed)
 
+    async def fetch_stats(self, report, query, window):
+        # windows are bucketed to the minute so repeated calls share a cache entry
+        key = (report, int(window.total_seconds() // 60))
+        now = self.bot.loop.time()
+
+        try:
+            expires, records = self._stats_cache[key]
+        except KeyError:
+            pass
+        else:
+            if expires > now:
+                return records
+
+        since = datetime.datetime.utcnow() - window
+        records = await self.bot.pool.fetch(query, since)
+
+        # windows are user typed, drop stale entries so the cache stays bounded
+        for stale in [k for k, (expires, _) in self._stats_cache.items() if expires <= now]:
+            del self._stats_cache[stale]
+        while len(self._stats_cache) >= self.stats_cache_size:
+            del self._stats_cache[min(self._stats_cache, key=lambda k: self._stats_cache[k][0])]
+
+        self._stats_cache[key] = (now + self.stats_ttl, records)
+        return records
+
+    async def send_stats(self, ctx, title, records):
+        if len(records) == 0:
+            return await ctx.send('No attributed joins in that window.')
+
+        table = formatting.TabularData()
+        table.set_columns(list(records[0].keys()))
+        table.add_rows(list(r.values()) for r in records)
+
+        await ctx.send(f'**{title}**\n{formatting.codeblock(table.render())}')
+
+    @commands.group(name='invitestats', invoke_without_command=True)
+    @commands.has_any_role('Queen', 'Inquiline')
+    @commands.guild_only()
+    async def invitestats(self, ctx, window: time.ShortTime = None):
+        """Show joins per invite code."""
+
+        await ctx.invoke(self.invitestats_codes, window)
+
+    @invitestats.command(name='codes')
+    @commands.has_any_role('Queen', 'Inquiline')
+    @commands.guild_only()
+    async def invitestats_codes(self, ctx, window: time.ShortTime = None):
+        """Show joins per invite code over a time window (default 7d)."""
+
+        window = window.delta if window is not None else datetime.timedelta(days=7)
+
+        query = """SELECT COALESCE(invite_code, 'ambiguous') AS code, COUNT(*) AS joins,
+                          COUNT(*) FILTER (WHERE joined - account_created < interval '7 days') AS new_accounts
+                   FROM invite_joins WHERE joined > $1
+                   GROUP BY invite_code ORDER BY joins DESC LIMIT 15;
+                """
+        records = await self.fetch_stats('codes', query, window)
+        await self.send_stats(ctx, f'Joins per invite in the last {time.human_timedelta(window)}', records)
+
+    @invitestats.command(name='inviters')
+    @commands.has_any_role('Queen', 'Inquiline')
+    @commands.guild_only()
+    async def invitestats_inviters(self, ctx, window: time.ShortTime = None):
+        """Show joins per invite creator over a time window (default 7d)."""
+
+        window = window.delta if window is not None else datetime.timedelta(days=7)
+
+        query = """SELECT inviter_id AS inviter, COUNT(*) AS joins, COUNT(DISTINCT invite_code) AS invites,
+                          COUNT(*) FILTER (WHERE joined - account_created < interval '7 days') AS new_accounts
+                   FROM invite_joins WHERE joined > $1
+                   GROUP BY inviter_id ORDER BY joins DESC LIMIT 15;
+                """
+        records = await self.fetch_stats('inviters', query, window)
+
+        guild = ctx.guild
+        records = [
+            {'inviter': str(guild.get_member(r['inviter']) or r['inviter']), 'joins': r['joins'], 'invites': r['invites'], 'new_accounts': r['new_accounts']}
+            for r in records
+        ]
+        await self.send_stats(ctx, f'Joins per inviter in the last {time.human_timedelta(window)}', records)
+
+    @invitestats.command(name='retention')
+    @commands.has_any_role('Queen', 'Inquiline')
+    @commands.guild_only()
+    async def invitestats_retention(self, ctx, window: time.ShortTime = None):
+        """Show how many joins per invite code are still in the server (default 30d)."""
+
+        window = window.delta if window is not None else datetime.timedelta(days=30)
+
+        query = """SELECT COALESCE(j.invite_code, 'ambiguous') AS code, COUNT(*) AS joins,
+                          COUNT(*) FILTER (WHERE NOT EXISTS (
+                              SELECT 1 FROM member_leaves l WHERE l.user_id = j.user_id AND l.left_at >= j.joined
+                          )) AS retained
+                   FROM invite_joins j WHERE j.joined > $1
+                   GROUP BY j.invite_code ORDER BY joins DESC LIMIT 15;
+                """
+        records = await self.fetch_stats('retention', query, window)
+
+        records = [
+            {'code': r['code'], 'joins': r['joins'], 'retained': r['retained'], 'rate': f'{r["retained"] / r["joins"] * 100:.0f}%'}
+            for r in records
+        ]
+        await self.send_stats(ctx, f'Retention per invite for the last {time.human_timedelta(window)}', records)
+
 
 def setup(bot):
     bot.add_cog(JoinLeaveLog(bot))
@@ -1,3 +1,5 @@
+import asyncio
+import datetime
 import logging
 
 import discord
@@ -15,6 +17,118 @@ class Lobby:
         self.welcome_channel = 'general'
         self.verified_role = 'Ant'
         self.welcome_role = 'Welcome'
+        self.verify_concurrency = 3
+        self.welcome_interval = 5.0
+        self.cleanup_interval = 1.0
+        self._ids = {}
+        self._verify_queue = asyncio.Queue(loop=bot.loop)
+        self._queued = set()
+        self._welcomes = []
+        self._welcome_ready = asyncio.Event(loop=bot.loop)
+        self._to_delete = []
+        self._cleanup_ready = asyncio.Event(loop=bot.loop)
+        self._workers = [bot.loop.create_task(self.verify_worker()) for _ in range(self.verify_concurrency)]
+        self._workers.append(bot.loop.create_task(self.welcome_worker()))
+        self._workers.append(bot.loop.create_task(self.cleanup_worker()))
+
+    def __unload(self):
+        for task in self._workers:
+            task.cancel()
+
+    def get_role(self, guild, name):
+        role = guild.get_role(self._ids.get(name))
+        if role is None or role.name != name:
+            role = discord.utils.get(guild.roles, name=name)
+            if role is not None:
+                self._ids[name] = role.id
+        return role
+
+    def get_channel(self, guild, name):
+        channel = guild.get_channel(self._ids.get(name))
+        if channel is None or channel.name != name:
+            channel = discord.utils.get(guild.channels, name=name)
+            if channel is not None:
+                self._ids[name] = channel.id
+        return channel
+
+    async def add_role(self, member, role, *, reason):
+        if role in member.roles:
+            return
+
+        for attempt in range(3):
+            try:
+                await member.add_roles(role, reason=reason)
+            except discord.errors.NotFound:
+                return
+            except discord.errors.HTTPException as ex:
+                # discord.py already waits out the bucket, this only covers
+                # a global limit or the API falling over mid-wave
+                if (ex.status != 429 and ex.status < 500) or attempt == 2:
+                    raise
+
+                await asyncio.sleep(2 ** attempt)
+            else:
+                return
+
+    async def verify_worker(self):
+        try:
+            await self.bot.wait_until_ready()
+            while not self.bot.is_closed():
+                member, welcome = await self._verify_queue.get()
+                self._queued.discard(member.id)
+
+                try:
+                    role = self.get_role(member.guild, self.verified_role)
+                    await self.add_role(member, role, reason='Verification')
+                except Exception as ex:
+                    self.bot.loop.call_exception_handler({'exception': ex})
+                    continue
+
+                if welcome:
+                    self._welcomes.append(member)
+                    self._welcome_ready.set()
+        except asyncio.CancelledError:
+            pass
+
+    async def welcome_worker(self):
+        try:
+            await self.bot.wait_until_ready()
+            while not self.bot.is_closed():
+                await self._welcome_ready.wait()
+                # give a verification wave time to gather into a single post
+                await asyncio.sleep(self.welcome_interval)
+                self._welcome_ready.clear()
+
+                members, self._welcomes = self._welcomes, []
+                try:
+                    await self.send_welcomes(members)
+                except Exception as ex:
+                    self.bot.loop.call_exception_handler({'exception': ex})
+        except asyncio.CancelledError:
+            pass
+
+    async def send_welcomes(self, members):
+        if len(members) == 0:
+            return
+
+        guild = members[0].guild
+        welcome_channel = self.get_channel(guild, self.welcome_channel)
+        welcome_role = self.get_role(guild, self.welcome_role)
+        suffix = f', {welcome_role.mention} to **{guild.name}**!'
+
+        mentions = []
+        length = len(suffix)
+        for member in members:
+            mention = member.mention
+            if mentions and length + len(mention) + 1 > 2000:
+                await welcome_channel.send(' '.join(mentions) + suffix)
+                mentions = []
+                length = len(suffix)
+
+            mentions.append(mention)
+            length += len(mention) + 1
+
+        await welcome_channel.send(' '.join(mentions) + suffix)
 
     async def on_message(self, message):
         if message.guild is None:
@@ -29,11 +143,49 @@ class Lobby:
         if message.author == self.bot.user:
             return
 
+        self._to_delete.append(message)
+        self._cleanup_ready.set()
+
+    async def cleanup_worker(self):
         try:
-            await message.delete()
-        except discord.errors.NotFound:
+            await self.bot.wait_until_ready()
+            while not self.bot.is_closed():
+                await self._cleanup_ready.wait()
+                await asyncio.sleep(self.cleanup_interval)
+                self._cleanup_ready.clear()
+
+                messages, self._to_delete = self._to_delete, []
+                try:
+                    await self.delete_messages(messages)
+                except Exception as ex:
+                    self.bot.loop.call_exception_handler({'exception': ex})
+        except asyncio.CancelledError:
             pass
 
+    async def delete_messages(self, messages):
+        # bulk delete refuses anything older than 14 days, leave a little slack
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=14) + datetime.timedelta(minutes=5)
+        recent = [m for m in messages if m.created_at > cutoff]
+        stragglers = [m for m in messages if m.created_at <= cutoff]
+
+        for i in range(0, len(recent), 100):
+            batch = recent[i:i + 100]
+            if len(batch) == 1:
+                stragglers.extend(batch)
+                continue
+
+            try:
+                await batch[0].channel.delete_messages(batch)
+            except discord.errors.HTTPException:
+                # one bad id fails the whole call, so fall back to deleting them one by one
+                stragglers.extend(batch)
+
+        for message in stragglers:
+            try:
+                await message.delete()
+            except discord.errors.NotFound:
+                pass
+
     @commands.command(hidden=True)
     @commands.bot_has_permissions(manage_roles=True)
     @commands.guild_only()
@@ -41,16 +193,25 @@ class Lobby:
         if ctx.channel.name != self.lobby_channel:
             return
 
-        if len(ctx.author.roles) > 1:
-            role = discord.utils.get(ctx.guild.roles, name=self.verified_role)
-            await ctx.author.add_roles(role, reason='Verification')
-        else:
-            role = discord.utils.get(ctx.guild.roles, name=self.verified_role)
-            await ctx.author.add_roles(role, reason='Verification')
+        if ctx.author.id in self._queued:
+            return
+
+        # only members with nothing but @everyone get welcomed
+        self._queued.add(ctx.author.id)
+        await self._verify_queue.put((ctx.author, len(ctx.author.roles) == 1))
+
+    def is_antiraid(self, guild):
+        channel = discord.utils.get(guild.channels, name=self.lobby_channel)
+        overwrite = channel.overwrites_for(guild.default_role)
+        return overwrite.send_messages is False
 
-            welcome_channel = discord.utils.get(ctx.guild.channels, name=self.welcome_channel)
-            welcome_role = discord.utils.get(ctx.guild.roles, name=self.welcome_role)
-            await welcome_channel.send(f'{ctx.author.mention}, {welcome_role.mention} to **{ctx.guild.name}**!')
+    async def set_antiraid(self, guild, enabled, *, reason):
+        channel = discord.utils.get(guild.channels, name=self.lobby_channel)
+
+        overwrite = dict(channel.overwrites)[guild.default_role]
+        overwrite.send_messages = not enabled
+
+        await channel.set_permissions(guild.default_role, overwrite=overwrite, reason=reason)
 
     @commands.group(name='antiraid', invoke_without_command=True)
     @commands.bot_has_permissions(manage_roles=True, manage_messages=True)
@@ -64,12 +225,7 @@ class Lobby:
         except discord.errors.NotFound:
             pass
 
-        channel = discord.utils.get(ctx.guild.channels, name=self.lobby_channel)
-
-        overwrite = dict(channel.overwrites)[ctx.guild.default_role]
-        overwrite.send_messages = False
-
-        await channel.set_permissions(ctx.guild.default_role, overwrite=overwrite, reason='AntiRaid Enabled')
+        await self.set_antiraid(ctx.guild, True, reason='AntiRaid Enabled')
         await ctx.send('AntiRaid enabled.')
 
     @antiraid.command(name='off')
@@ -84,12 +240,7 @@ class Lobby:
         except discord.errors.NotFound:
             pass
 
-        channel = discord.utils.get(ctx.guild.channels, name=self.lobby_channel)
-
-        overwrite = dict(channel.overwrites)[ctx.guild.default_role]
-        overwrite.send_messages = True
-
-        await channel.set_permissions(ctx.guild.default_role, overwrite=overwrite, reason='AntiRaid Disabled')
+        await self.set_antiraid(ctx.guild, False, reason='AntiRaid Disabled')
         await ctx.send('AntiRaid disabled.')
 
 
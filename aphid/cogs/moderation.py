@@ -581,27 +581,36 @@ class Moderation:
     async def cases(self, ctx, member: converters.UserConverter):
         """View all mod cases for a member."""
 
-        query = 'SELECT * FROM mod_cases WHERE user_id = $1 ORDER BY issued DESC;'
-        records = await self.bot.pool.fetch(query, member.id)
+        async def count():
+            query = 'SELECT COUNT(*) FROM mod_cases WHERE user_id = $1;'
+            return await self.bot.pool.fetchval(query, member.id)
+
+        async def source(offset, limit):
+            query = 'SELECT * FROM mod_cases WHERE user_id = $1 ORDER BY issued DESC LIMIT $2 OFFSET $3;'
+            records = await self.bot.pool.fetch(query, member.id, limit, offset)
+
+            entries = []
+            for record in records:
+                id = record['id']
+                action = record['action']
+                issued = time.human_timedelta(datetime.datetime.utcnow() - record['issued'], largest_only=True)
+                duration = record['duration']
+                duration = time.human_timedelta(duration) if duration is not None else None
+                reason = record['reason']
+
+                if duration is None:
+                    entries.append(f'#{id} • *{action.capitalize()}* • {reason} • {issued} ago')
+                else:
+                    entries.append(f'#{id} • *{action.capitalize()}* ({duration}) • {reason} • {issued} ago')
 
-        if len(records) == 0:
-            return await ctx.send("None found.")
+            return entries
 
-        entries = []
-        for record in records:
-            id = record['id']
-            action = record['action']
-            issued = time.human_timedelta(datetime.datetime.utcnow() - record['issued'], largest_only=True)
-            duration = record['duration']
-            duration = time.human_timedelta(duration) if duration is not None else None
-            reason = record['reason']
-
-            if duration is None:
-                entries.append(f'#{id} • *{action.capitalize()}* • {reason} • {issued} ago')
-            else:
-                entries.append(f'#{id} • *{action.capitalize()}* ({duration}) • {reason} • {issued} ago')
+        p = Pages(ctx, source=source, count=count)
+        await p.prepare()
+
+        if p.total_entries == 0:
+            return await ctx.send("None found.")
 
-        p = Pages(ctx, entries=entries)
         p.embed.set_author(name=f'{member} Cases', icon_url=member.avatar_url)
         p.embed.colour = discord.Colour.red()
         await p.paginate()
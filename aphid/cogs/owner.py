@@ -1,16 +1,28 @@
 import asyncio
+import cProfile
 import datetime
+import gc
+import hashlib
 import io
+import json
 import logging
+import os
+import pstats
+import tempfile
 import textwrap
+import threading
 import time
 import traceback
+import tracemalloc
 from contextlib import redirect_stdout
 
+import asyncpg
 import discord
 from discord.ext import commands
 
-from utils import formatting
+from utils import formatting, memory
+from utils.paginator import HelpPaginator
+from utils.sampler import StackSampler
 
 log = logging.getLogger(__name__)
 
@@ -19,6 +31,12 @@ class Owner:
     def __init__(self, bot):
         self.bot = bot
         self._last_result = None
+        self.sql_batch_size = 500
+        self.sql_spool_size = 1024 * 1024
+        self.sql_upload_size = 8 * 1024 * 1024
+        self.plan_directory = 'plans'
+        self._snapshot = None
+        self._snapshot_taken = None
 
     @commands.command(hidden=True)
     @commands.is_owner()
@@ -54,6 +72,7 @@ class Owner:
     @commands.command(hidden=True)
     @commands.is_owner()
     async def load(self, ctx, module: str):
+        HelpPaginator.invalidate()
         try:
             self.bot.load_extension(module)
         except Exception as ex:
@@ -65,6 +84,7 @@ class Owner:
     @commands.command(hidden=True)
     @commands.is_owner()
     async def unload(self, ctx, module: str):
+        HelpPaginator.invalidate()
         try:
             self.bot.unload_extension(module)
         except Exception as ex:
@@ -76,6 +96,7 @@ class Owner:
     @commands.command(hidden=True)
     @commands.is_owner()
     async def reload(self, ctx, module: str):
+        HelpPaginator.invalidate()
         try:
             self.bot.unload_extension(module)
             self.bot.load_extension(module)
@@ -94,6 +115,8 @@ class Owner:
             modules.append(module)
         modules.remove('cogs.owner')
 
+        HelpPaginator.invalidate()
+
         for module in modules:
             try:
                 self.bot.unload_extension(module)
@@ -107,6 +130,8 @@ class Owner:
     @commands.command(hidden=True)
     @commands.is_owner()
     async def eval(self, ctx, *, body: str):
+        """Runs code. Start with --profile to also get a CPU and allocation profile."""
+
         env = {
             'bot': self.bot,
             'ctx': ctx,
@@ -117,6 +142,13 @@ class Owner:
             '_': self._last_result
         }
 
+        profile = None
+        flag, *rest = body.split(None, 1)
+        if flag == '--profile':
+            # the rest has to start at the code block for cleanup_code to find it
+            body = rest[0].lstrip() if rest else ''
+            profile = EvalProfile()
+
         async with ctx.channel.typing():
             env.update(globals())
 
@@ -133,7 +165,11 @@ class Owner:
             func = env['func']
             try:
                 with redirect_stdout(stdout):
-                    ret = await func()
+                    if profile is not None:
+                        with profile:
+                            ret = await func()
+                    else:
+                        ret = await func()
             except Exception as e:
                 value = stdout.getvalue()
                 await ctx.send(formatting.codeblock(f'{value}{e}', lang='py'))
@@ -147,40 +183,452 @@ class Owner:
                     self._last_result = ret
                     await ctx.send(formatting.codeblock(f'{value}{ret}', lang='py'))
 
+            if profile is not None:
+                report = profile.report()
+                if len(report) > 1990:
+                    fp = io.BytesIO(report.encode('utf-8'))
+                    await ctx.send(file=discord.File(fp, 'profile.txt'))
+                else:
+                    await ctx.send(formatting.codeblock(report))
+
     @commands.command(hidden=True)
     @commands.is_owner()
-    async def sql(self, ctx, *, query: str):
-        query = formatting.cleanup_code(query)
+    async def sample(self, ctx, seconds: float = 10.0, interval: float = 5.0):
+        """Samples what the bot is running for some seconds, every interval milliseconds.
 
-        is_multistatement = query.count(';') > 1
-        if is_multistatement:
-            strategy = self.bot.pool.execute
-        else:
-            strategy = self.bot.pool.fetch
+        The result is collapsed stacks, as read by flamegraph.pl and speedscope.
+        """
 
-        try:
-            start = time.perf_counter()
-            results = await strategy(query)
-            dt = (time.perf_counter() - start) * 1000.0
-        except Exception:
-            return await ctx.send(formatting.codeblock(traceback.format_exc(), lang='py'))
-
-        rows = len(results)
-        if is_multistatement or rows == 0:
-            return await ctx.send(formatting.codeblock(f'{dt:.2f}ms: {results}'))
+        seconds = min(max(seconds, 1.0), 120.0)
+        interval = max(interval, 1.0) / 1000.0
+
+        # commands run on the loop's thread, which is the one to sample
+        sampler = StackSampler(threading.get_ident(), interval=interval, tags=StackSampler.bot_tags(self.bot))
+
+        await ctx.send(f'Sampling for {seconds:g}s...')
+        await self.bot.loop.run_in_executor(None, sampler.run, seconds)
+
+        fp = io.BytesIO(sampler.render().encode('utf-8'))
+        await ctx.send(f'{formatting.pluralise(sample=sampler.count)} of {len(sampler.samples)} distinct stacks.',
+                       file=discord.File(fp, 'stacks.txt'))
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def stats(self, ctx, kind: str = None):
+        """Shows how long listeners and commands take, optionally only one kind of them."""
+
+        histograms = self.bot.latency_stats.histograms
+        if kind is not None:
+            kind = kind.rstrip('s')
+            histograms = {key: value for key, value in histograms.items() if key[0] == kind}
+
+        if len(histograms) == 0:
+            return await ctx.send('Nothing recorded yet.')
 
-        headers = list(results[0].keys())
         table = formatting.TabularData()
-        table.set_columns(headers)
-        table.add_rows(list(r.values()) for r in results)
+        table.set_columns(['Handler', 'Count', 'Errors', 'p50', 'p95', 'p99', 'Max'])
+
+        # the handlers the bot spends the most time in first
+        for (handler_kind, name), histogram in sorted(histograms.items(), key=lambda h: h[1].total, reverse=True):
+            table.add_row([
+                f'{handler_kind}:{name}', histogram.count, histogram.errors,
+                *(f'{histogram.percentile(q) * 1000:.1f}ms' for q in (50, 95, 99)),
+                f'{histogram.max * 1000:.1f}ms'
+            ])
+
         render = table.render()
+        if len(render) > 1990:
+            fp = io.BytesIO(render.encode('utf-8'))
+            await ctx.send(file=discord.File(fp, 'stats.txt'))
+        else:
+            await ctx.send(formatting.codeblock(render))
+
+    @commands.group(hidden=True, invoke_without_command=True)
+    @commands.is_owner()
+    async def memory(self, ctx):
+        """Shows the size of the bot's caches and what is taking up memory."""
+
+        # the bot and cogs are referenced from everywhere, don't count them as part of each cache
+        exclude = (self.bot, *self.bot.cogs.values())
+
+        caches = list(memory.tracked_caches(self.bot))
+
+        def measure():
+            sizes = [memory.deep_sizeof(obj, exclude=exclude) for _, obj in caches]
+            return sizes, memory.top_types()
+
+        # walking the caches and the gc takes long enough to stall the gateway
+        async with ctx.channel.typing():
+            sizes, types = await self.bot.loop.run_in_executor(None, measure)
+
+        table = formatting.TabularData()
+        table.set_columns(['Cache', 'Entries', 'Size'])
+        for (name, obj), (size, truncated) in zip(caches, sizes):
+            entries = len(obj) if hasattr(obj, '__len__') else '-'
+            table.add_row([name, entries, memory.human_size(size, truncated=truncated)])
+
+        state = self.bot._connection
+        table.add_row(['discord users', len(self.bot.users), '-'])
+        table.add_row(['discord members', sum(len(g.members) for g in self.bot.guilds), '-'])
+        table.add_row(['discord messages', len(state._messages) if state._messages is not None else 0, '-'])
+
+        objects = formatting.TabularData()
+        objects.set_columns(['Type', 'Objects'])
+        objects.add_rows(types)
+
+        rss = memory.rss()
+        collections = [stats['collections'] for stats in gc.get_stats()]
+        lines = [
+            table.render(),
+            '',
+            f'RSS: {memory.human_size(rss) if rss is not None else "unknown"}',
+            f'GC counts: {gc.get_count()}, collections: {tuple(collections)}',
+            f'tracemalloc: {"tracing" if tracemalloc.is_tracing() else "off"}',
+            '',
+            objects.render(),
+        ]
+
+        render = '\n'.join(lines)
+        if len(render) > 1990:
+            fp = io.BytesIO(render.encode('utf-8'))
+            await ctx.send(file=discord.File(fp, 'memory.txt'))
+        else:
+            await ctx.send(formatting.codeblock(render))
+
+    @memory.command(name='snapshot')
+    @commands.is_owner()
+    async def memory_snapshot(self, ctx):
+        """Takes a tracemalloc snapshot to diff against later."""
 
-        fmt = f'{formatting.codeblock(render)}\n*Returned {formatting.pluralise(row=rows)} in {dt:.2f}ms*'
-        if len(fmt) > 2000:
-            fp = io.BytesIO(fmt.encode('utf-8'))
-            await ctx.send('Too many results...', file=discord.File(fp, 'results.txt'))
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+
+        self._snapshot = tracemalloc.take_snapshot()
+        self._snapshot_taken = datetime.datetime.utcnow()
+
+        if started:
+            await ctx.send('Started tracing and took a snapshot. Only allocations from now on are traced.')
+        else:
+            await ctx.send('Took a snapshot.')
+
+    @memory.command(name='diff')
+    @commands.is_owner()
+    async def memory_diff(self, ctx, limit: int = 15):
+        """Shows where memory grew since the last snapshot."""
+
+        if self._snapshot is None or not tracemalloc.is_tracing():
+            return await ctx.send(f'No snapshot, take one with `{ctx.prefix}memory snapshot` first.')
+
+        current = tracemalloc.take_snapshot()
+        stats = current.compare_to(self._snapshot, 'lineno')[:limit]
+        minutes = (datetime.datetime.utcnow() - self._snapshot_taken).total_seconds() / 60
+
+        lines = [f'Top {len(stats)} changes over {minutes:.1f} minutes:']
+        lines.extend(str(stat) for stat in stats)
+
+        render = '\n'.join(lines)
+        if len(render) > 1990:
+            fp = io.BytesIO(render.encode('utf-8'))
+            await ctx.send(file=discord.File(fp, 'memory-diff.txt'))
         else:
-            await ctx.send(fmt)
+            await ctx.send(formatting.codeblock(render))
+
+    @memory.command(name='stop')
+    @commands.is_owner()
+    async def memory_stop(self, ctx):
+        """Stops tracing allocations and drops the snapshot."""
+
+        tracemalloc.stop()
+        self._snapshot = None
+        await ctx.send('Stopped tracing.')
+
+    def parse_sql_flags(self, query):
+        flags = {'style': 'rst', 'explain': False, 'timeout': None, 'limit': None}
+
+        query = query.strip()
+        while query.startswith('--'):
+            flag, *rest = query.split(None, 1)
+            rest = rest[0] if rest else ''
+
+            if flag in ('--csv', '--markdown'):
+                flags['style'] = flag[2:]
+            elif flag == '--explain':
+                flags['explain'] = True
+            elif flag in ('--timeout', '--limit'):
+                if not rest.strip():
+                    raise commands.BadArgument(f'{flag} takes a number.')
+
+                value, *rest = rest.split(None, 1)
+                rest = rest[0] if rest else ''
+                try:
+                    value = float(value) if flag == '--timeout' else int(value)
+                except ValueError:
+                    raise commands.BadArgument(f'{flag} takes a number.') from None
+                if value <= 0:
+                    raise commands.BadArgument(f'{flag} must be positive.')
+                if flag == '--timeout':
+                    # statement_timeout is in whole milliseconds and 0 would turn it off
+                    value = max(value, 0.001)
+                flags[flag[2:]] = value
+            else:
+                # an SQL comment
+                break
+
+            query = rest.strip()
+
+        return formatting.cleanup_code(query), flags
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def sql(self, ctx, *, query: str):
+        """Runs a query.
+
+        Flags go before the query:
+        --csv, --markdown: the table format
+        --limit N: stop after N rows
+        --timeout N: cancel the query after N seconds
+        --explain: show and save the plan from EXPLAIN (ANALYZE, BUFFERS)
+        """
+
+        try:
+            query, flags = self.parse_sql_flags(query)
+        except commands.BadArgument as ex:
+            return await ctx.send(str(ex))
+
+        timeout = flags['timeout']
+
+        if flags['explain']:
+            try:
+                plan = await asyncio.wait_for(self.explain_query(query, timeout), timeout)
+            except (asyncio.TimeoutError, asyncpg.QueryCanceledError):
+                return await ctx.send(f'Query cancelled after {timeout}s.')
+            except Exception:
+                return await ctx.send(formatting.codeblock(traceback.format_exc(), lang='py'))
+
+            path = self.save_plan(query, plan)
+            render = format_plan(plan)
+            fmt = f'{formatting.codeblock(render)}\n*Plan saved to {path}*'
+            if len(fmt) > 2000:
+                fp = io.BytesIO(render.encode('utf-8'))
+                return await ctx.send(f'*Plan saved to {path}*', file=discord.File(fp, 'plan.txt'))
+            return await ctx.send(fmt)
+
+        is_multistatement = query.count(';') > 1
+        if is_multistatement:
+            try:
+                start = time.perf_counter()
+                results = await asyncio.wait_for(self.bot.pool.execute(query), timeout)
+                dt = (time.perf_counter() - start) * 1000.0
+            except (asyncio.TimeoutError, asyncpg.QueryCanceledError):
+                return await ctx.send(f'Query cancelled after {timeout}s.')
+            except Exception:
+                return await ctx.send(formatting.codeblock(traceback.format_exc(), lang='py'))
+
+            return await ctx.send(formatting.codeblock(f'{dt:.2f}ms: {results}'))
+
+        # rows are pulled through a server-side cursor and written straight out,
+        # spilling to disk if there are a lot of them
+        sink = tempfile.SpooledTemporaryFile(max_size=self.sql_spool_size)
+        try:
+            try:
+                start = time.perf_counter()
+                rows, truncated = await asyncio.wait_for(
+                    self.stream_query(query, sink, flags['style'], flags['limit'], timeout, self.sql_upload_size), timeout
+                )
+                dt = (time.perf_counter() - start) * 1000.0
+            except (asyncio.TimeoutError, asyncpg.QueryCanceledError):
+                return await ctx.send(f'Query cancelled after {timeout}s.')
+            except Exception:
+                return await ctx.send(formatting.codeblock(traceback.format_exc(), lang='py'))
+
+            if rows == 0 and not truncated:
+                return await ctx.send(formatting.codeblock(f'{dt:.2f}ms: []'))
+
+            footer = f'*Returned {formatting.pluralise(row=rows)} in {dt:.2f}ms*'
+            if rows == flags['limit']:
+                footer = f'*Stopped at {formatting.pluralise(row=rows)} after {dt:.2f}ms*'
+            elif truncated:
+                footer = f'*Cut off at {formatting.pluralise(row=rows)} after {dt:.2f}ms, the rest would go past the upload limit*'
+
+            if sink.tell() < 1900:
+                sink.seek(0)
+                render = sink.read().decode('utf-8').rstrip('\n')
+                fmt = f'{formatting.codeblock(render)}\n{footer}'
+                if len(fmt) <= 2000:
+                    return await ctx.send(fmt)
+
+            sink.seek(0)
+            extension = {'rst': 'txt', 'markdown': 'md', 'csv': 'csv'}[flags['style']]
+            await ctx.send(footer, file=discord.File(sink, f'results.{extension}'))
+        finally:
+            sink.close()
+
+    async def stream_query(self, query, fp, style, limit, timeout, max_bytes):
+        async with self.bot.pool.acquire() as con:
+            statement = await con.prepare(query)
+            if len(statement.get_attributes()) == 0:
+                # nothing to stream, and some of these (VACUUM, CREATE INDEX CONCURRENTLY)
+                # can't run inside the transaction a cursor needs
+                await statement.fetch()
+                return 0, False
+
+            async with con.transaction():
+                if timeout is not None:
+                    # cancelled by the server too, in case we never get to cancel it ourselves
+                    await con.execute(f'SET LOCAL statement_timeout = {int(timeout * 1000)};')
+
+                remaining = limit
+                size = self.sql_batch_size if limit is None else min(limit, self.sql_batch_size)
+
+                cursor = await statement.cursor()
+                batch = await cursor.fetch(size)
+                if len(batch) == 0:
+                    return 0, False
+
+                # column widths come from the first batch, longer values after it are cut
+                table = formatting.TabularData(style=style)
+                table.set_columns(list(batch[0].keys()))
+                table.fit(batch)
+
+                footer = table.footer().encode('utf-8')
+                rows = 0
+                truncated = False
+                fp.write(table.header().encode('utf-8'))
+                while len(batch) > 0:
+                    chunk = table.format_rows(batch).encode('utf-8')
+                    if fp.tell() + len(chunk) + len(footer) <= max_bytes:
+                        rows += len(batch)
+                        fp.write(chunk)
+                    else:
+                        # stop reading once nothing more could be uploaded,
+                        # keeping whichever rows of this batch still fit
+                        truncated = True
+                        for row in batch:
+                            line = table.format_rows([row]).encode('utf-8')
+                            if fp.tell() + len(line) + len(footer) > max_bytes:
+                                break
+                            rows += 1
+                            fp.write(line)
+                        break
+
+                    if len(batch) < size:
+                        break
+
+                    if remaining is not None:
+                        remaining -= len(batch)
+                        if remaining == 0:
+                            break
+                        size = min(remaining, size)
+
+                    batch = await cursor.fetch(size)
+
+                fp.write(footer)
+                return rows, truncated
+
+    async def explain_query(self, query, timeout):
+        async with self.bot.pool.acquire() as con:
+            tr = con.transaction()
+            await tr.start()
+            try:
+                if timeout is not None:
+                    await con.execute(f'SET LOCAL statement_timeout = {int(timeout * 1000)};')
+                plan = await con.fetchval(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}')
+            finally:
+                # ANALYZE really runs the query, so throw away anything it changed
+                await tr.rollback()
+
+        return json.loads(plan)[0]
+
+    def save_plan(self, query, plan):
+        # named by query so plans of the same query sort next to each other
+        digest = hashlib.sha1(' '.join(query.split()).encode('utf-8')).hexdigest()[:10]
+        captured = datetime.datetime.utcnow()
+        path = os.path.join(self.plan_directory, f'{digest}-{captured:%Y%m%d-%H%M%S}.json')
+
+        os.makedirs(self.plan_directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as fp:
+            json.dump({'query': query, 'captured': captured.isoformat(), 'plan': plan}, fp, indent=2)
+
+        return path
+
+
+class EvalProfile:
+    """Profiles a block with cProfile and compares tracemalloc snapshots from either side of it.
+
+    The profiler sees everything the event loop runs while the block is
+    awaiting, not just the block itself.
+    """
+
+    def __init__(self, *, limit=20):
+        self.limit = limit
+        self.profiler = cProfile.Profile()
+        self._started_tracing = False
+        self._before = None
+        self._after = None
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+        self._before = tracemalloc.take_snapshot()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.disable()
+        self._after = tracemalloc.take_snapshot()
+
+        if self._started_tracing:
+            tracemalloc.stop()
+
+    def report(self):
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=stream)
+        stats.strip_dirs().sort_stats('cumulative').print_stats(self.limit)
+        lines = [stream.getvalue().strip(), '', f'Top {self.limit} allocation sites:']
+
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ]
+        before = self._before.filter_traces(filters)
+        after = self._after.filter_traces(filters)
+        for stat in after.compare_to(before, 'lineno')[:self.limit]:
+            lines.append(str(stat))
+
+        return '\n'.join(lines)
+
+
+def format_plan(plan):
+    """Renders an EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) plan as an indented tree."""
+    lines = [f'Planning {plan["Planning Time"]:.2f}ms, execution {plan["Execution Time"]:.2f}ms']
+
+    def walk(node, depth):
+        label = node['Node Type']
+        if 'Relation Name' in node:
+            label += f' on {node["Relation Name"]}'
+        if 'Index Name' in node:
+            label += f' using {node["Index Name"]}'
+
+        stats = f'{node["Actual Total Time"]:.2f}ms rows={node["Actual Rows"]}'
+        if node.get('Actual Loops', 1) != 1:
+            stats += f' loops={node["Actual Loops"]}'
+
+        hit = node.get('Shared Hit Blocks', 0)
+        read = node.get('Shared Read Blocks', 0)
+        if hit or read:
+            stats += f' hit={hit} read={read}'
+
+        prefix = '  ' * depth + ('-> ' if depth else '')
+        lines.append(f'{prefix}{label} ({stats})')
+
+        for child in node.get('Plans', ()):
+            walk(child, depth + 1)
+
+    walk(plan['Plan'], 0)
+    return '\n'.join(lines)
 
 
 def setup(bot):
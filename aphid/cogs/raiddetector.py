@@ -0,0 +1,130 @@
+import datetime
+import logging
+import time
+
+import discord
+from discord.ext import commands
+
+log = logging.getLogger(__name__)
+
+
+class SlidingCounter:
+    """Counts events over the last ``window`` seconds in one-second buckets.
+
+    Both adding and reading are amortised O(1) and the memory used is fixed
+    by the window, no matter how many events come in.
+    """
+
+    __slots__ = ('window', 'total', '_buckets', '_last')
+
+    def __init__(self, window):
+        self.window = window
+        self.total = 0
+        self._buckets = [0] * window
+        self._last = 0
+
+    def _advance(self, now):
+        now = int(now)
+        if now <= self._last:
+            return
+
+        # clear every bucket we skipped over since the last event
+        for second in range(max(self._last + 1, now - self.window + 1), now + 1):
+            index = second % self.window
+            self.total -= self._buckets[index]
+            self._buckets[index] = 0
+
+        self._last = now
+
+    def add(self, now, amount=1):
+        self._advance(now)
+        self._buckets[int(now) % self.window] += amount
+        self.total += amount
+
+    def count(self, now):
+        self._advance(now)
+        return self.total
+
+
+class RaidDetector:
+    """Locks the lobby automatically when joins look like a raid."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.log_channel = 'mod-logs'
+        self.window = 60
+        self.join_threshold = 15
+        self.new_account_threshold = 0.6
+        self.new_account_min_joins = 6
+        self.new_account_age = datetime.timedelta(days=7)
+        self.rearm_after = 600.0
+        self._joins = SlidingCounter(self.window)
+        self._new_accounts = SlidingCounter(self.window)
+        self._triggered_at = None
+
+    def rates(self, now=None):
+        now = time.monotonic() if now is None else now
+        return self._joins.count(now), self._new_accounts.count(now)
+
+    def check(self, now):
+        joins, new_accounts = self.rates(now)
+
+        if joins >= self.join_threshold:
+            return f'{joins} joins in {self.window}s'
+
+        if joins >= self.new_account_min_joins and new_accounts / joins >= self.new_account_threshold:
+            return f'{new_accounts}/{joins} joins in {self.window}s from new accounts'
+
+        return None
+
+    async def on_member_join(self, member):
+        if member.guild.id != self.bot.guild_id:
+            return
+
+        now = time.monotonic()
+        self._joins.add(now)
+        if datetime.datetime.utcnow() - member.created_at <= self.new_account_age:
+            self._new_accounts.add(now)
+
+        if self._triggered_at is not None and now - self._triggered_at < self.rearm_after:
+            return
+
+        reason = self.check(now)
+        if reason is None:
+            return
+
+        self._triggered_at = now
+        await self.lock(member.guild, reason)
+
+    async def lock(self, guild, reason):
+        lobby = self.bot.get_cog('Lobby')
+        if lobby is None:
+            return
+
+        if lobby.is_antiraid(guild):
+            return
+
+        await lobby.set_antiraid(guild, True, reason=f'AntiRaid Auto: {reason}')
+        log.warning(f'AntiRaid automatically enabled: {reason}')
+
+        embed = discord.Embed(colour=discord.Colour.red())
+        embed.set_author(name='AntiRaid Enabled')
+        embed.description = f'Lobby locked automatically: {reason}.'
+        embed.set_footer(text=f'Disable with {self.bot.command_prefix}antiraid off')
+        embed.timestamp = datetime.datetime.utcnow()
+
+        channel = discord.utils.get(guild.channels, name=self.log_channel)
+        await channel.send(embed=embed)
+
+    @commands.command(name='joinrate')
+    @commands.has_any_role('Queen', 'Inquiline')
+    @commands.guild_only()
+    async def joinrate(self, ctx):
+        """Show the current join rate seen by the raid detector."""
+
+        joins, new_accounts = self.rates()
+        await ctx.send(f'{joins} joins ({new_accounts} new accounts) in the last {self.window}s. Locks at {self.join_threshold} joins or {self.new_account_threshold:.0%} new accounts.')
+
+
+def setup(bot):
+    bot.add_cog(RaidDetector(bot))
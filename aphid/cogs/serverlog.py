@@ -1,13 +1,169 @@
+import asyncio
+import collections
 import datetime
+import io
 import logging
+import sys
 
 import discord
+from discord.ext import commands
 
 from utils import formatting
+from utils.batch import BatchWriter
 
 log = logging.getLogger(__name__)
 
 
+class CachedMessage:
+    __slots__ = ('id', 'channel_id', 'author_id', 'author', 'bot', 'content', 'attachments', 'size')
+
+    def __init__(self, *, id, channel_id, author_id, author, bot, content, attachments):
+        self.id = id
+        self.channel_id = channel_id
+        self.author_id = author_id
+        self.author = author
+        self.bot = bot
+        self.content = content
+        self.attachments = attachments
+        self.size = self.measure()
+
+    @classmethod
+    def from_message(cls, message):
+        return cls(
+            id=message.id,
+            channel_id=message.channel.id,
+            author_id=message.author.id,
+            author=str(message.author),
+            bot=message.author.bot,
+            content=message.content,
+            attachments=tuple(attachment.proxy_url for attachment in message.attachments)
+        )
+
+    @classmethod
+    def from_bot_message(cls, message):
+        return cls(
+            id=message.id,
+            channel_id=message.channel.id,
+            author_id=message.author.id,
+            author=str(message.author),
+            bot=True,
+            content='',
+            attachments=()
+        )
+
+    def measure(self):
+        # ints are shared small objects for the most part, the strings are what matter
+        size = sys.getsizeof(self) + sys.getsizeof(self.author) + sys.getsizeof(self.content)
+        size += sys.getsizeof(self.attachments) + sum(sys.getsizeof(a) for a in self.attachments)
+        return size
+
+    def edit(self, content):
+        self.content = content
+        self.size = self.measure()
+
+
+class MessageCache:
+    """Per-channel LRU cache of message content bounded by an approximate byte budget."""
+
+    def __init__(self, *, max_bytes, max_per_channel):
+        self.max_bytes = max_bytes
+        self.max_per_channel = max_per_channel
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._channels = {}
+        self._channel_sizes = {}
+
+    def __len__(self):
+        return sum(len(c) for c in self._channels.values())
+
+    def add(self, message):
+        channel = self._channels.setdefault(message.channel_id, collections.OrderedDict())
+
+        old = channel.pop(message.id, None)
+        if old is not None:
+            self._account(message.channel_id, -old.size)
+
+        channel[message.id] = message
+        self._account(message.channel_id, message.size)
+
+        while len(channel) > self.max_per_channel:
+            self._evict(message.channel_id)
+
+        self._trim()
+
+    def get(self, channel_id, message_id):
+        try:
+            channel = self._channels[channel_id]
+            message = channel[message_id]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        channel.move_to_end(message_id)
+        self.hits += 1
+        return message
+
+    def pop(self, channel_id, message_id):
+        try:
+            channel = self._channels[channel_id]
+            message = channel.pop(message_id)
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self._account(channel_id, -message.size)
+        self.hits += 1
+
+        if len(channel) == 0:
+            self.remove_channel(channel_id)
+
+        return message
+
+    def edit(self, message, content):
+        self._account(message.channel_id, -message.size)
+        message.edit(content)
+        self._account(message.channel_id, message.size)
+        self._trim()
+
+    def remove_channel(self, channel_id):
+        self._channels.pop(channel_id, None)
+        self.size -= self._channel_sizes.pop(channel_id, 0)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self),
+            'channels': len(self._channels),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions
+        }
+
+    def _account(self, channel_id, size):
+        self.size += size
+        self._channel_sizes[channel_id] = self._channel_sizes.get(channel_id, 0) + size
+
+    def _trim(self):
+        while self.size > self.max_bytes:
+            # take from the heaviest channel so busy channels can't starve quiet ones
+            channel_id = max(self._channel_sizes, key=self._channel_sizes.get)
+            self._evict(channel_id)
+
+    def _evict(self, channel_id):
+        channel = self._channels[channel_id]
+        _, message = channel.popitem(last=False)
+        self._account(channel_id, -message.size)
+        self.evictions += 1
+
+        if len(channel) == 0:
+            self.remove_channel(channel_id)
+
+
 class ServerLog:
     def __init__(self, bot):
         self.bot = bot
@@ -17,74 +173,287 @@ class ServerLog:
             'admin-stuff',
             'bot-test-stuff'
         ]
-
-    async def on_message_delete(self, message):
-        if message.guild is None:
+        self.delete_window = 2.0
+        self.message_cache = MessageCache(max_bytes=32 * 1024 * 1024, max_per_channel=10000)
+        self.archive_retention = 6
+        self.archive = BatchWriter(
+            bot, 'message_audit',
+            ['message_id', 'channel_id', 'author_id', 'action', 'content', 'new_content', 'attachments', 'logged'],
+            interval=5.0, max_rows=500, before_flush=self.ensure_partitions
+        )
+        self._partitions = set()
+        self._pending_deletes = {}
+        self._delete_tasks = {}
+
+    def __unload(self):
+        # deletions still in their window are logged now rather than lost,
+        # ahead of the archive close so their rows make the last flush
+        for channel_id, task in list(self._delete_tasks.items()):
+            task.cancel()
+            channel = self.bot.get_channel(channel_id)
+            if channel is not None:
+                self.bot.loop.create_task(self.flush_deletes(channel, delay=False))
+
+        self.bot.loop.create_task(self.archive.close())
+
+    @staticmethod
+    def partition_bounds(when):
+        start = datetime.datetime(when.year, when.month, 1)
+        end = datetime.datetime(when.year + start.month // 12, start.month % 12 + 1, 1)
+        return start, end
+
+    async def ensure_partitions(self, rows):
+        months = {(row[-1].year, row[-1].month) for row in rows}
+
+        for year, month in months - self._partitions:
+            start, end = self.partition_bounds(datetime.datetime(year, month, 1))
+            query = f"CREATE TABLE IF NOT EXISTS message_audit_{year}_{month:02} PARTITION OF message_audit FOR VALUES FROM ('{start}') TO ('{end}');"
+            await self.bot.pool.execute(query)
+            self._partitions.add((year, month))
+
+    async def drop_partitions(self, months):
+        now = datetime.datetime.utcnow()
+        cutoff, _ = self.partition_bounds(now - datetime.timedelta(days=31 * months))
+
+        query = "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = 'message_audit';"
+        records = await self.bot.pool.fetch(query)
+
+        dropped = []
+        for record in records:
+            name = record['relname']
+            year, month = (int(part) for part in name.rsplit('_', 2)[1:])
+            if datetime.datetime(year, month, 1) < cutoff:
+                # dropping a whole partition is a catalog change, no row-by-row delete or vacuum
+                await self.bot.pool.execute(f'DROP TABLE IF EXISTS {name};')
+                self._partitions.discard((year, month))
+                dropped.append(name)
+
+        return dropped
+
+    def archive_message(self, action, message_id, channel_id, message, *, new_content=None):
+        if message is None:
+            row = (message_id, channel_id, None, action, None, new_content, None, datetime.datetime.utcnow())
+        else:
+            row = (message_id, channel_id, message.author_id, action, message.content, new_content, list(message.attachments), datetime.datetime.utcnow())
+
+        self.archive.add(row)
+
+    def is_logged_channel(self, channel):
+        if channel is None or not isinstance(channel, discord.TextChannel):
+            return False
+
+        if channel.guild.id != self.bot.guild_id:
+            return False
+
+        return channel.name not in self.ignored_channels
+
+    def queue_delete(self, channel, message_id, message=None):
+        pending = self._pending_deletes.setdefault(channel.id, {})
+
+        # only the raw events take from our cache, they fire for every
+        # deletion so a second lookup would just count as a miss
+        if message is None:
+            message = self.message_cache.pop(channel.id, message_id)
+
+        # the raw event fires for every deletion, the cached one only when
+        # discord.py still had the message, so never overwrite content with None
+        if message is not None or message_id not in pending:
+            pending[message_id] = message
+
+        if channel.id not in self._delete_tasks:
+            self._delete_tasks[channel.id] = self.bot.loop.create_task(self.flush_deletes(channel))
+
+    async def flush_deletes(self, channel, *, delay=True):
+        try:
+            if delay:
+                await asyncio.sleep(self.delete_window)
+        except asyncio.CancelledError:
             return
 
-        if message.guild.id != self.bot.guild_id:
+        self._delete_tasks.pop(channel.id, None)
+        pending = self._pending_deletes.pop(channel.id, {})
+        pending = {k: v for k, v in pending.items() if v is None or not v.bot}
+
+        for message_id, message in pending.items():
+            self.archive_message('delete', message_id, channel.id, message)
+
+        try:
+            if len(pending) == 1:
+                message_id, message = next(iter(pending.items()))
+                await self.log_delete(channel, message_id, message)
+            elif len(pending) > 1:
+                await self.log_bulk_delete(channel, pending)
+        except Exception as ex:
+            self.bot.loop.call_exception_handler({'exception': ex})
+
+    async def log_delete(self, channel, message_id, message):
+        embed = discord.Embed(colour=discord.Colour.red())
+
+        if message is None:
+            embed.set_author(name='Message Deleted')
+            embed.add_field(name='Channel', value=channel.mention, inline=False)
+            embed.add_field(name='Message', value='Not cached')
+            embed.set_footer(text=f'Message ID: {message_id}')
+        else:
+            member = channel.guild.get_member(message.author_id)
+
+            embed.set_author(name='Message Deleted', icon_url=member.avatar_url if member is not None else discord.Embed.Empty)
+            embed.description = f'<@{message.author_id}> {message.author}'
+
+            embed.add_field(name='Channel', value=channel.mention, inline=False)
+            embed.add_field(name='Message', value=formatting.truncate(message.content, 512) if message.content != '' else 'None')
+
+            for attachment in message.attachments:
+                embed.add_field(name='Attachment', value=attachment)
+
+            embed.set_footer(text=f'ID: {message.author_id}')
+
+        embed.timestamp = datetime.datetime.utcnow()
+
+        log_channel = discord.utils.get(channel.guild.channels, name=self.log_channel)
+        await log_channel.send(embed=embed)
+
+    async def log_bulk_delete(self, channel, pending):
+        messages = [(message_id, pending[message_id]) for message_id in sorted(pending)]
+        uncached = sum(1 for _, message in messages if message is None)
+        authors = {message.author_id for _, message in messages if message is not None}
+
+        lines = []
+        for message_id, message in messages:
+            created = discord.utils.snowflake_time(message_id).isoformat(sep=' ', timespec='seconds')
+            if message is None:
+                lines.append(f'[{created}] (ID: {message_id}) <not cached>')
+                continue
+
+            lines.append(f'[{created}] {message.author} (ID: {message.author_id}): {message.content}')
+            for attachment in message.attachments:
+                lines.append(f'    Attachment: {attachment}')
+
+        embed = discord.Embed(colour=discord.Colour.dark_red())
+        embed.set_author(name='Messages Deleted')
+        embed.description = f'{formatting.pluralise(message=len(messages))} deleted in {channel.mention}.'
+
+        embed.add_field(name='Authors', value=str(len(authors)))
+        embed.add_field(name='Not Cached', value=str(uncached))
+
+        embed.set_footer(text=f'Channel ID: {channel.id}')
+        embed.timestamp = datetime.datetime.utcnow()
+
+        fp = io.BytesIO('\n'.join(lines).encode('utf-8'))
+        log_channel = discord.utils.get(channel.guild.channels, name=self.log_channel)
+        await log_channel.send(embed=embed, file=discord.File(fp, f'deleted-{channel.id}.txt'))
+
+    async def on_message(self, message):
+        if not self.is_logged_channel(message.channel):
             return
 
         if message.author.bot:
+            # only the id and author matter, so a delete of it isn't logged as uncached
+            self.message_cache.add(CachedMessage.from_bot_message(message))
             return
 
-        for channel in self.ignored_channels:
-            if message.channel.name == channel:
-                return
+        self.message_cache.add(CachedMessage.from_message(message))
 
-        member = message.author
-        channel = message.channel
+    async def on_message_delete(self, message):
+        if not self.is_logged_channel(message.channel):
+            return
 
-        embed = discord.Embed(colour=discord.Colour.red())
-        embed.set_author(name='Message Deleted', icon_url=member.avatar_url)
-        embed.description = f'{member.mention} {member}'
+        self.queue_delete(message.channel, message.id, CachedMessage.from_message(message))
 
-        embed.add_field(name='Channel', value=channel.mention, inline=False)
-        embed.add_field(name='Message', value=formatting.truncate(message.content, 512) if message.content != '' else 'None')
+    async def on_bulk_message_delete(self, messages):
+        if len(messages) == 0 or not self.is_logged_channel(messages[0].channel):
+            return
 
-        for attachment in message.attachments:
-            embed.add_field(name='Attachment', value=attachment.proxy_url)
+        for message in messages:
+            self.queue_delete(message.channel, message.id, CachedMessage.from_message(message))
 
-        embed.set_footer(text=f'ID: {member.id}')
-        embed.timestamp = datetime.datetime.utcnow()
+    async def on_raw_message_delete(self, payload):
+        channel = self.bot.get_channel(payload.channel_id)
+        if not self.is_logged_channel(channel):
+            return
 
-        channel = discord.utils.get(message.guild.channels, name=self.log_channel)
-        await channel.send(embed=embed)
+        self.queue_delete(channel, payload.message_id)
 
-    async def on_message_edit(self, before, after):
-        message = after
-        if message.guild is None:
+    async def on_raw_bulk_message_delete(self, payload):
+        channel = self.bot.get_channel(payload.channel_id)
+        if not self.is_logged_channel(channel):
             return
 
-        if message.guild.id != self.bot.guild_id:
+        for message_id in payload.message_ids:
+            self.queue_delete(channel, message_id)
+
+    async def on_raw_message_edit(self, payload):
+        # embed-only updates (link previews and the like) carry no content
+        if 'content' not in payload.data:
             return
 
-        if message.author.bot:
+        channel = self.bot.get_channel(int(payload.data['channel_id']))
+        if not self.is_logged_channel(channel):
             return
 
-        for channel in self.ignored_channels:
-            if message.channel.name == channel:
-                return
+        message = self.message_cache.get(channel.id, payload.message_id)
+        if message is None or message.bot:
+            return
+
+        before = message.content
+        after = payload.data['content']
 
-        if before.content == after.content:
+        if before == after:
             return
 
-        member = message.author
-        channel = message.channel
+        self.archive_message('edit', message.id, channel.id, message, new_content=after)
+        self.message_cache.edit(message, after)
+
+        member = channel.guild.get_member(message.author_id)
 
         embed = discord.Embed(colour=discord.Colour.orange())
-        embed.set_author(name='Message Edited', icon_url=member.avatar_url)
-        embed.description = f'{member.mention} {member}'
+        embed.set_author(name='Message Edited', icon_url=member.avatar_url if member is not None else discord.Embed.Empty)
+        embed.description = f'<@{message.author_id}> {message.author}'
 
         embed.add_field(name='Channel', value=channel.mention, inline=False)
-        embed.add_field(name='Before', value=formatting.truncate(before.content, 512) if before.content != '' else 'None', inline=False)
-        embed.add_field(name='After', value=formatting.truncate(after.content, 512) if after.content != '' else 'None', inline=False)
+        embed.add_field(name='Before', value=formatting.truncate(before, 512) if before != '' else 'None', inline=False)
+        embed.add_field(name='After', value=formatting.truncate(after, 512) if after != '' else 'None', inline=False)
 
-        embed.set_footer(text=f'ID: {member.id}')
+        embed.set_footer(text=f'ID: {message.author_id}')
         embed.timestamp = datetime.datetime.utcnow()
 
-        channel = discord.utils.get(message.guild.channels, name=self.log_channel)
-        await channel.send(embed=embed)
+        log_channel = discord.utils.get(channel.guild.channels, name=self.log_channel)
+        await log_channel.send(embed=embed)
+
+    async def on_guild_channel_delete(self, channel):
+        self.message_cache.remove_channel(channel.id)
+
+    @commands.command(name='messagecache', hidden=True)
+    @commands.is_owner()
+    async def message_cache_stats(self, ctx):
+        stats = self.message_cache.stats()
+
+        embed = discord.Embed(title='Message Cache', colour=discord.Colour.green())
+        embed.add_field(name='Entries', value=f'{stats["entries"]} in {stats["channels"]} channels')
+        embed.add_field(name='Memory', value=f'{stats["bytes"] / 1024 / 1024:.2f}/{stats["max_bytes"] / 1024 / 1024:.0f} MiB')
+        embed.add_field(name='Hit Rate', value=f'{stats["hit_rate"] * 100:.1f}% ({stats["hits"]}/{stats["hits"] + stats["misses"]})')
+        embed.add_field(name='Evictions', value=str(stats['evictions']))
+
+        await ctx.send(embed=embed)
+
+    @commands.group(name='messagearchive', hidden=True, invoke_without_command=True)
+    @commands.is_owner()
+    async def message_archive(self, ctx):
+        await ctx.send(f'{formatting.pluralise(row=len(self.archive))} buffered, {self.archive.written} written, {self.archive.dropped} dropped.')
+
+    @message_archive.command(name='prune', hidden=True)
+    @commands.is_owner()
+    async def message_archive_prune(self, ctx, months: int = None):
+        if months is not None and months < 1:
+            return await ctx.send('Months must be at least 1.')
+
+        await self.archive.flush()
+        dropped = await self.drop_partitions(months if months is not None else self.archive_retention)
+
+        if len(dropped) == 0:
+            return await ctx.send('No partitions to drop.')
+
+        await ctx.send(f'Dropped {", ".join(dropped)}.')
 
     async def on_member_update(self, before, after):
         member = after
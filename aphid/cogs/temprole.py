@@ -58,28 +58,36 @@ class TempRole:
         """Lists temporary roles."""
 
         if member is None:
-            query = 'SELECT * FROM temproles INNER JOIN timers ON temproles.timer_id = timers.id ORDER BY timers.expires;'
-            records = await self.bot.pool.fetch(query)
+            count_query = 'SELECT COUNT(*) FROM temproles INNER JOIN timers ON temproles.timer_id = timers.id;'
+            query = 'SELECT * FROM temproles INNER JOIN timers ON temproles.timer_id = timers.id ORDER BY timers.expires LIMIT $1 OFFSET $2;'
+            args = ()
         else:
-            query = 'SELECT * FROM temproles INNER JOIN timers ON temproles.timer_id = timers.id WHERE user_id = $1 ORDER BY timers.expires;'
-            records = await self.bot.pool.fetch(query, member.id)
+            count_query = 'SELECT COUNT(*) FROM temproles INNER JOIN timers ON temproles.timer_id = timers.id WHERE user_id = $1;'
+            query = 'SELECT * FROM temproles INNER JOIN timers ON temproles.timer_id = timers.id WHERE user_id = $3 ORDER BY timers.expires LIMIT $1 OFFSET $2;'
+            args = (member.id,)
 
-        if len(records) == 0:
-            return await ctx.send('No temporary roles to list.')
+        async def count():
+            return await self.bot.pool.fetchval(count_query, *args)
 
-        # embed = discord.Embed(title='Temprole List', colour=discord.Colour.green())
+        async def source(offset, limit):
+            records = await self.bot.pool.fetch(query, limit, offset, *args)
 
-        # embed.description = ''
-        entries = []
-        for record in records:
-            user = discord.utils.get(ctx.guild.members, id=record['user_id'])
-            role = discord.utils.get(ctx.guild.roles, id=record['role_id'])
-            expires = record['expires'].isoformat(timespec='minutes')
+            entries = []
+            for record in records:
+                user = ctx.guild.get_member(record['user_id'])
+                role = ctx.guild.get_role(record['role_id'])
+                expires = record['expires'].isoformat(timespec='minutes')
 
-            # embed.description = embed.description + f'**{user}** {role} **Expires:** {expires} UTC\n'
-            entries.append(f'**{user}** {role} **Expires:** {expires} UTC')
+                entries.append(f'**{user}** {role} **Expires:** {expires} UTC')
+
+            return entries
+
+        p = Pages(ctx, source=source, count=count)
+        await p.prepare()
+
+        if p.total_entries == 0:
+            return await ctx.send('No temporary roles to list.')
 
-        p = Pages(ctx, entries=entries)
         p.embed.set_author(name='Temprole List')
         p.embed.colour = discord.Colour.green()
         await p.paginate()
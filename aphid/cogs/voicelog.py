@@ -1,15 +1,141 @@
+import asyncio
 import datetime
 import logging
 
 import discord
+from discord.ext import commands
+
+from utils import formatting, time
+from utils.batch import BatchWriter
 
 log = logging.getLogger(__name__)
 
 
-class ServerLog:
+class VoiceSession:
+    __slots__ = ('channel_id', 'started')
+
+    def __init__(self, channel_id, started):
+        self.channel_id = channel_id
+        self.started = started
+
+
+class VoiceHop:
+    __slots__ = ('member', 'channels', 'task')
+
+    def __init__(self, member, channel):
+        self.member = member
+        self.channels = [channel]
+        self.task = None
+
+
+class VoiceLog:
+    """Voice channel activity."""
+
     def __init__(self, bot):
         self.bot = bot
         self.log_channel = 'voice-logs'
+        self.hop_window = 10.0
+        self._channels = {}
+        self._sessions = {}
+        self._totals = {}
+        self._hops = {}
+        self._writer = BatchWriter(bot, 'voice_sessions', ['user_id', 'channel_id', 'started', 'ended'], interval=30.0)
+        self._task = bot.loop.create_task(self.init_sessions())
+
+    def __unload(self):
+        self._task.cancel()
+
+        # switches still in their window are logged now rather than lost
+        for hop in list(self._hops.values()):
+            hop.task.cancel()
+            self.bot.loop.create_task(self.flush_hop(hop.member, delay=False))
+
+        # sessions still open are cut off here, otherwise they'd be lost
+        now = datetime.datetime.utcnow()
+        for member_id in list(self._sessions):
+            self.close_session(member_id, now)
+
+        self.bot.loop.create_task(self._writer.close())
+
+    async def init_sessions(self):
+        try:
+            await self.bot.wait_until_ready()
+
+            guild = self.bot.get_guild(self.bot.guild_id)
+            now = datetime.datetime.utcnow()
+            for channel in guild.voice_channels:
+                for member in channel.members:
+                    self.open_session(member.id, channel.id, now)
+        except asyncio.CancelledError:
+            pass
+        except Exception as ex:
+            self.bot.loop.call_exception_handler({'exception': ex})
+
+    def open_session(self, member_id, channel_id, now):
+        self._sessions[member_id] = VoiceSession(channel_id, now)
+        self._channels.setdefault(channel_id, set()).add(member_id)
+
+    def close_session(self, member_id, now):
+        session = self._sessions.pop(member_id, None)
+        if session is None:
+            return
+
+        members = self._channels.get(session.channel_id)
+        if members is not None:
+            members.discard(member_id)
+            if len(members) == 0:
+                del self._channels[session.channel_id]
+
+        duration = (now - session.started).total_seconds()
+        self._totals[member_id] = self._totals.get(member_id, 0.0) + duration
+        self._writer.add((member_id, session.channel_id, session.started, now))
+
+    def time_in_voice(self, member_id, now):
+        total = self._totals.get(member_id, 0.0)
+        session = self._sessions.get(member_id)
+        if session is not None:
+            total += (now - session.started).total_seconds()
+        return total
+
+    def queue_hop(self, member, before, after):
+        hop = self._hops.get(member.id)
+        if hop is None:
+            hop = self._hops[member.id] = VoiceHop(member, before)
+        else:
+            hop.task.cancel()
+
+        hop.channels.append(after)
+        hop.task = self.bot.loop.create_task(self.flush_hop(member))
+
+    async def flush_hop(self, member, *, delay=True):
+        try:
+            if delay:
+                await asyncio.sleep(self.hop_window)
+        except asyncio.CancelledError:
+            return
+
+        hop = self._hops.pop(member.id, None)
+        if hop is None:
+            return
+
+        embed = discord.Embed(colour=discord.Colour.teal())
+        embed.set_author(name='Voice Switched', icon_url=member.avatar_url)
+        embed.description = f'{member.mention} {str(member)}'
+
+        if len(hop.channels) == 2:
+            embed.add_field(name='Before', value=hop.channels[0].name, inline=False)
+            embed.add_field(name='After', value=hop.channels[1].name, inline=False)
+        else:
+            embed.add_field(name='Path', value=formatting.truncate(' → '.join(c.name for c in hop.channels), 1024), inline=False)
+
+        embed.set_footer(text=f'ID: {member.id}')
+        embed.timestamp = datetime.datetime.utcnow()
+
+        channel = discord.utils.get(member.guild.channels, name=self.log_channel)
+        try:
+            await channel.send(embed=embed)
+        except Exception as ex:
+            self.bot.loop.call_exception_handler({'exception': ex})
 
     async def on_voice_state_update(self, member, before, after):
         if member.guild is None:
@@ -18,6 +144,15 @@ class ServerLog:
         if member.guild.id != self.bot.guild_id:
             return
 
+        if before.channel == after.channel:
+            return
+
+        now = datetime.datetime.utcnow()
+        if before.channel is not None:
+            self.close_session(member.id, now)
+        if after.channel is not None:
+            self.open_session(member.id, after.channel.id, now)
+
         if before.channel is None and after.channel is not None:
             # joined voice
             embed = discord.Embed(colour=discord.Colour.teal())
@@ -31,22 +166,16 @@ class ServerLog:
 
             channel = discord.utils.get(member.guild.channels, name=self.log_channel)
             await channel.send(embed=embed)
-        elif before.channel is not None and after.channel is not None and before.channel != after.channel:
-            # changed channel
-            embed = discord.Embed(colour=discord.Colour.teal())
-            embed.set_author(name='Voice Switched', icon_url=member.avatar_url)
-            embed.description = f'{member.mention} {str(member)}'
-
-            embed.add_field(name='Before', value=before.channel.name, inline=False)
-            embed.add_field(name='After', value=after.channel.name, inline=False)
-
-            embed.set_footer(text=f'ID: {member.id}')
-            embed.timestamp = datetime.datetime.utcnow()
-
-            channel = discord.utils.get(member.guild.channels, name=self.log_channel)
-            await channel.send(embed=embed)
+        elif before.channel is not None and after.channel is not None:
+            # changed channel, hops in quick succession are logged together
+            self.queue_hop(member, before.channel, after.channel)
         elif before.channel is not None and after.channel is None:
             # left voice
+            hop = self._hops.get(member.id)
+            if hop is not None:
+                hop.task.cancel()
+                await self.flush_hop(member, delay=False)
+
             embed = discord.Embed(colour=discord.Colour.dark_teal())
             embed.set_author(name='Voice Left', icon_url=member.avatar_url)
             embed.description = f'{member.mention} {str(member)}'
@@ -59,6 +188,58 @@ class ServerLog:
             channel = discord.utils.get(member.guild.channels, name=self.log_channel)
             await channel.send(embed=embed)
 
+    @commands.group(name='voice', invoke_without_command=True)
+    @commands.bot_has_permissions(embed_links=True)
+    @commands.has_any_role('Queen', 'Inquiline')
+    @commands.guild_only()
+    async def voice(self, ctx):
+        """Show who is currently in each voice channel."""
+
+        now = datetime.datetime.utcnow()
+        embed = discord.Embed(title='Voice Occupancy', colour=discord.Colour.teal())
+
+        for channel_id, members in sorted(self._channels.items(), key=lambda c: len(c[1]), reverse=True)[:25]:
+            channel = ctx.guild.get_channel(channel_id)
+            lines = []
+            for member_id in members:
+                member = ctx.guild.get_member(member_id)
+                duration = datetime.timedelta(seconds=int((now - self._sessions[member_id].started).total_seconds()))
+                lines.append(f'{member or member_id} ({time.human_timedelta(duration, largest_only=True) or "0 seconds"})')
+
+            name = channel.name if channel is not None else str(channel_id)
+            embed.add_field(name=f'{name} ({len(members)})', value=formatting.truncate('\n'.join(lines), 1024), inline=False)
+
+        if len(embed.fields) == 0:
+            embed.description = 'Nobody is in voice.'
+
+        await ctx.send(embed=embed)
+
+    @voice.command(name='time')
+    @commands.bot_has_permissions(embed_links=True)
+    @commands.has_any_role('Queen', 'Inquiline')
+    @commands.guild_only()
+    async def voice_time(self, ctx, member: discord.Member = None):
+        """Show time spent in voice since the bot started."""
+
+        now = datetime.datetime.utcnow()
+
+        if member is not None:
+            duration = datetime.timedelta(seconds=int(self.time_in_voice(member.id, now)))
+            return await ctx.send(f'{member} has spent {time.human_timedelta(duration) or "no time"} in voice.')
+
+        member_ids = set(self._totals) | set(self._sessions)
+        ranked = sorted(((self.time_in_voice(m, now), m) for m in member_ids), reverse=True)[:15]
+
+        embed = discord.Embed(title='Time in Voice', colour=discord.Colour.teal())
+        lines = []
+        for seconds, member_id in ranked:
+            member = ctx.guild.get_member(member_id)
+            lines.append(f'**{member or member_id}** {time.human_timedelta(datetime.timedelta(seconds=int(seconds)))}')
+
+        embed.description = '\n'.join(lines) if lines else 'No voice activity yet.'
+        embed.set_footer(text='Since the bot started')
+        await ctx.send(embed=embed)
+
 
 def setup(bot):
-    bot.add_cog(ServerLog(bot))
+    bot.add_cog(VoiceLog(bot))
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+
+import asyncpg
+
+log = logging.getLogger(__name__)
+
+# failures that say nothing about the rows, the batch is kept for a retry
+TRANSIENT_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.InsufficientResourcesError,
+    asyncpg.OperatorInterventionError
+)
+
+# failures caused by a row the table won't take, retrying the batch as is never helps
+DATA_ERRORS = (asyncpg.PostgresError, ValueError, TypeError)
+
+
+class BatchWriter:
+    """Buffers rows in memory and writes them to a table with COPY.
+
+    The buffer is flushed every ``interval`` seconds, or as soon as it
+    holds ``max_rows`` rows. Callers only ever append to a list, so
+    nothing on the gateway path waits on the database.
+
+    A batch that fails on a connection problem is kept for the next
+    flush. One the table rejects is split in halves until the offending
+    rows are found, and those are dropped. Writers register with the bot
+    so :meth:`AphidBot.close` can write out what is left.
+
+    Parameters
+    ------------
+    bot: AphidBot
+        The bot, used for its loop and connection pool.
+    table: str
+        The table to copy into.
+    columns: List[str]
+        The column names, in the same order as the row tuples.
+    interval: float
+        How long to wait between flushes, in seconds.
+    max_rows: int
+        How many buffered rows trigger an early flush.
+    before_flush: Optional[Callable]
+        A coroutine function called with the rows before each copy,
+        e.g. to create partitions they need.
+    """
+
+    def __init__(self, bot, table, columns, *, interval=5.0, max_rows=500, before_flush=None):
+        self.bot = bot
+        self.table = table
+        self.columns = columns
+        self.interval = interval
+        self.max_rows = max_rows
+        self.max_buffered = max_rows * 20
+        self.before_flush = before_flush
+        self.written = 0
+        self.dropped = 0
+        self._rows = []
+        self._full = asyncio.Event(loop=bot.loop)
+        self._lock = asyncio.Lock(loop=bot.loop)
+        self._task = bot.loop.create_task(self.run())
+        bot.batch_writers.add(self)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self.max_rows:
+            self._full.set()
+
+    async def run(self):
+        try:
+            await self.bot.wait_until_ready()
+            while not self.bot.is_closed():
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+
+                self._full.clear()
+                await self.flush()
+        except asyncio.CancelledError:
+            await self.flush()
+        except Exception as ex:
+            self.bot.loop.call_exception_handler({'exception': ex})
+
+    async def flush(self):
+        # held for the whole copy so a flush from close() waits for one
+        # already in flight, and sees any rows it had to put back
+        async with self._lock:
+            if len(self._rows) == 0:
+                return
+
+            rows, self._rows = self._rows, []
+
+            # batches still to copy, the next one last
+            pending = [rows]
+
+            try:
+                if self.before_flush is not None:
+                    await self.before_flush(rows)
+
+                while pending:
+                    batch = pending[-1]
+                    try:
+                        await self.bot.pool.copy_records_to_table(self.table, records=batch, columns=self.columns)
+                    except TRANSIENT_ERRORS:
+                        raise
+                    except DATA_ERRORS as ex:
+                        pending.pop()
+                        if len(batch) == 1:
+                            self.dropped += 1
+                            log.warning(f'Dropped a row rejected by {self.table}: {type(ex).__name__} - {ex}')
+                        else:
+                            half = len(batch) // 2
+                            pending += [batch[half:], batch[:half]]
+                    else:
+                        pending.pop()
+                        self.written += len(batch)
+            except asyncio.CancelledError:
+                self.requeue(pending)
+                raise
+            except Exception as ex:
+                self.requeue(pending)
+                log.warning(f'Failed to copy {len(rows)} rows into {self.table}: {type(ex).__name__} - {ex}')
+
+    def requeue(self, pending):
+        self._rows[:0] = [row for batch in reversed(pending) for row in batch]
+
+        # keep the rows for the next attempt, but don't let a dead
+        # database grow the buffer forever
+        overflow = len(self._rows) - self.max_buffered
+        if overflow > 0:
+            del self._rows[:overflow]
+            self.dropped += overflow
+
+    async def close(self):
+        self._task.cancel()
+        await self.flush()
+        self.bot.batch_writers.discard(self)
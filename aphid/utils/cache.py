@@ -0,0 +1,151 @@
+import collections
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """An LRU cache whose entries expire after a time to live.
+
+    ``None`` is a valid value, so a lookup that misses raises
+    :exc:`KeyError` rather than returning ``None``. If ``path`` is given,
+    entries are also written to an SQLite file and loaded back on
+    creation, which lets them survive restarts. Keys must be strings and
+    values JSON serialisable in that case.
+
+    Changes are only written when :meth:`flush` is called, so lookups and
+    sets never touch the disk. :meth:`take_changes` and
+    :meth:`write_changes` split a flush so the write can happen in an
+    executor.
+
+    Parameters
+    ------------
+    maxsize: int
+        How many entries to keep before evicting the least recently used.
+    ttl: float
+        The default time to live of an entry, in seconds.
+    path: Optional[str]
+        The SQLite file to persist entries to.
+    """
+
+    def __init__(self, *, maxsize=256, ttl=3600.0, path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._db = None
+        self._dirty = {}
+        self._cleared = False
+        self._lock = threading.Lock()
+
+        if path is not None:
+            # written from an executor thread, one write at a time under the lock
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL NOT NULL);')
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, key):
+        try:
+            value, expires = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            raise
+
+        if expires < time.time():
+            self.misses += 1
+            self.pop(key)
+            raise KeyError(key)
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, *, ttl=None):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+
+        if self._db is not None:
+            self._dirty[key] = (value, expires)
+
+        while len(self._entries) > self.maxsize:
+            old, _ = self._entries.popitem(last=False)
+            self._forget(old)
+
+    def pop(self, key):
+        value, _ = self._entries.pop(key, (None, None))
+        self._forget(key)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+        if self._db is not None:
+            self._dirty.clear()
+            self._cleared = True
+
+    def load(self):
+        now = time.time()
+        with self._db:
+            self._db.execute('DELETE FROM cache WHERE expires < ?;', (now,))
+
+        rows = self._db.execute('SELECT key, value, expires FROM cache ORDER BY expires DESC LIMIT ?;', (self.maxsize,))
+        for key, value, expires in reversed(rows.fetchall()):
+            self._entries[key] = (json.loads(value), expires)
+
+    def take_changes(self):
+        """Returns the changes made since the last call, to hand to :meth:`write_changes`."""
+        if self._db is None or (not self._dirty and not self._cleared):
+            return None
+
+        changes = (self._cleared, self._dirty)
+        self._dirty = {}
+        self._cleared = False
+        return changes
+
+    def write_changes(self, changes):
+        """Writes changes from :meth:`take_changes` in one transaction. Safe to call from another thread."""
+        if changes is None:
+            return
+
+        cleared, dirty = changes
+        writes = [(key, json.dumps(entry[0]), entry[1]) for key, entry in dirty.items() if entry is not None]
+        deletes = [(key,) for key, entry in dirty.items() if entry is None]
+
+        with self._lock:
+            if self._db is None:
+                return
+
+            with self._db:
+                if cleared:
+                    self._db.execute('DELETE FROM cache;')
+                self._db.executemany('DELETE FROM cache WHERE key = ?;', deletes)
+                self._db.executemany('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?);', writes)
+
+    def flush(self):
+        self.write_changes(self.take_changes())
+
+    def close(self):
+        if self._db is not None:
+            self.flush()
+            with self._lock:
+                self._db.close()
+                self._db = None
+
+    def _forget(self, key):
+        if self._db is not None:
+            self._dirty[key] = None
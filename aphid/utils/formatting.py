@@ -1,5 +1,9 @@
 # Stolen from https://github.com/slice/lifesaver/blob/master/lifesaver/utils/formatting.py
 
+import csv
+import io
+import itertools
+
 
 def escape_backticks(text: str) -> str:
     """
@@ -124,7 +128,24 @@ def human_join(seq, delim=', ', final='or'):
 
 
 class TabularData:
-    def __init__(self):
+    """
+    Renders rows of data as a table.
+    Rows can either be added up front and rendered at once, or the column
+    widths can be fitted to a sample of rows and the table streamed out
+    a chunk at a time with :meth:`stream`, without holding every row.
+    Parameters
+    ----------
+    style
+        The output format, one of ``rst``, ``markdown`` or ``csv``.
+    """
+
+    styles = ('rst', 'markdown', 'csv')
+
+    def __init__(self, *, style: str = 'rst'):
+        if style not in self.styles:
+            raise ValueError(f'Unknown table style {style!r}')
+
+        self.style = style
         self._widths = []
         self._columns = []
         self._rows = []
@@ -133,6 +154,20 @@ class TabularData:
         self._columns = columns
         self._widths = [len(c) + 2 for c in columns]
 
+    def fit(self, rows):
+        """
+        Widens the columns to fit rows without keeping them.
+        Parameters
+        ----------
+        rows
+            The rows to fit, usually a sample of what will be streamed.
+        """
+        for row in rows:
+            for index, element in enumerate(row):
+                width = len(str(element)) + 2
+                if width > self._widths[index]:
+                    self._widths[index] = width
+
     def add_row(self, row):
         rows = [str(r) for r in row]
         self._rows.append(rows)
@@ -145,8 +180,81 @@ class TabularData:
         for row in rows:
             self.add_row(row)
 
+    def _separator(self):
+        sep = '+'.join('-' * w for w in self._widths)
+        return f'+{sep}+\n'
+
+    def _entry(self, row):
+        if self.style == 'markdown':
+            elem = ' | '.join(str(e).replace('|', '\\|').replace('\n', ' ') for e in row)
+            return f'| {elem} |\n'
+
+        # widths fitted from a sample may be too narrow for later rows
+        cells = (truncate(str(e).replace('\n', ' '), self._widths[i] - 2) for i, e in enumerate(row))
+        elem = '|'.join(f'{e:^{self._widths[i]}}' for i, e in enumerate(cells))
+        return f'|{elem}|\n'
+
+    def header(self) -> str:
+        """Returns the part of the table above the first row."""
+        if self.style == 'csv':
+            return self.format_rows([self._columns])
+
+        if self.style == 'markdown':
+            return self._entry(self._columns) + '|' + '|'.join('---' for _ in self._columns) + '|\n'
+
+        sep = self._separator()
+        return sep + self._entry(self._columns) + sep
+
+    def footer(self) -> str:
+        """Returns the part of the table below the last row."""
+        if self.style == 'rst':
+            return self._separator()
+        return ''
+
+    def format_rows(self, rows) -> str:
+        """
+        Renders rows without adding them to the table.
+        Parameters
+        ----------
+        rows
+            The rows to render.
+        Returns
+        -------
+        str
+            The rendered rows, each ending in a newline.
+        """
+        if self.style == 'csv':
+            fp = io.StringIO()
+            csv.writer(fp, lineterminator='\n').writerows(('' if e is None else e for e in row) for row in rows)
+            return fp.getvalue()
+
+        return ''.join(self._entry(row) for row in rows)
+
+    def stream(self, fp, rows, *, chunk_size: int = 100):
+        """
+        Writes the table to a file-like object.
+        Parameters
+        ----------
+        fp
+            A text file-like object to write to.
+        rows
+            An iterable of rows, consumed ``chunk_size`` rows at a time.
+        chunk_size
+            How many rows to render per write.
+        """
+        fp.write(self.header())
+
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if len(chunk) == 0:
+                break
+            fp.write(self.format_rows(chunk))
+
+        fp.write(self.footer())
+
     def render(self):
-        """Renders a table in rST format.
+        """Renders the added rows, in rST format by default.
 
         Example:
 
@@ -158,20 +266,6 @@ class TabularData:
         +-------+-----+
         """
 
-        sep = '+'.join('-' * w for w in self._widths)
-        sep = f'+{sep}+'
-
-        to_draw = [sep]
-
-        def get_entry(d):
-            elem = '|'.join(f'{e:^{self._widths[i]}}' for i, e in enumerate(d))
-            return f'|{elem}|'
-
-        to_draw.append(get_entry(self._columns))
-        to_draw.append(sep)
-
-        for row in self._rows:
-            to_draw.append(get_entry(row))
-
-        to_draw.append(sep)
-        return '\n'.join(to_draw)
+        fp = io.StringIO()
+        self.stream(fp, self._rows)
+        return fp.getvalue().rstrip('\n')
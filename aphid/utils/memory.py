@@ -0,0 +1,141 @@
+import collections
+import gc
+import sys
+import types
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# (cog, attribute) pairs of the in-process structures worth keeping an eye on
+TRACKED_CACHES = [
+    ('Ants', '_cache'),
+    ('Ants', '_inflight'),
+    ('AutoRole', '_settled'),
+    ('JoinLeaveLog', '_invite_cache'),
+    ('JoinLeaveLog', '_stats_cache'),
+    ('Lobby', '_queued'),
+    ('Lobby', '_welcomes'),
+    ('Lobby', '_to_delete'),
+    ('Owner', '_last_result'),
+    ('RaidDetector', '_joins'),
+    ('ServerLog', 'message_cache'),
+    ('ServerLog', 'archive'),
+    ('ServerLog', '_pending_deletes'),
+    ('StickyMessage', '_stickymessage_cache'),
+    ('StickyMessage', '_locks'),
+    ('Timers', '_timer_done'),
+    ('VoiceLog', '_sessions'),
+    ('VoiceLog', '_totals'),
+    ('VoiceLog', '_writer'),
+]
+
+# objects from these point into state shared with the rest of the bot,
+# so only their own size is counted
+_shallow_modules = {'discord', 'asyncio', 'aiohttp', 'asyncpg', 'sqlite3'}
+_atoms = (str, bytes, bytearray, int, float, complex, bool, type(None))
+_opaque = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType, types.CodeType, types.FrameType)
+
+
+def tracked_caches(bot):
+    """Yields ``(name, object)`` for each tracked cache whose cog is loaded."""
+    for cog_name, attr in TRACKED_CACHES:
+        cog = bot.get_cog(cog_name)
+        if cog is not None and hasattr(cog, attr):
+            yield f'{cog_name}.{attr}', getattr(cog, attr)
+
+    yield 'paginators', bot.paginators
+
+
+def deep_sizeof(obj, *, exclude=(), limit=200000):
+    """
+    Approximates the memory held by an object and everything it refers to.
+    discord.py, asyncio and database objects are counted shallowly, and
+    the walk stops after ``limit`` objects. It takes a while on big caches,
+    so call it from an executor.
+    Parameters
+    ----------
+    obj
+        The object to measure.
+    exclude
+        Objects not to count or walk into, such as the bot.
+    limit
+        The most objects to visit.
+    Returns
+    -------
+    Tuple[int, bool]
+        The approximate size in bytes, and whether the walk hit ``limit``
+        so the real size is larger.
+    """
+    seen = {id(o) for o in exclude}
+    stack = [obj]
+    size = 0
+
+    while stack and len(seen) < limit:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+
+        if isinstance(o, _atoms) or isinstance(o, _opaque):
+            continue
+
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset, collections.deque)):
+            stack.extend(o)
+        elif type(o).__module__.partition('.')[0] in _shallow_modules:
+            continue
+        else:
+            attrs = getattr(o, '__dict__', None)
+            if attrs is not None:
+                stack.append(attrs)
+
+            for cls in type(o).__mro__:
+                slots = cls.__dict__.get('__slots__', ())
+                for slot in (slots,) if isinstance(slots, str) else slots:
+                    try:
+                        stack.append(getattr(o, slot))
+                    except AttributeError:
+                        pass
+
+    return size, any(id(o) not in seen for o in stack)
+
+
+def rss():
+    """Returns the resident set size in bytes, or the peak if the current one can't be read."""
+    try:
+        with open('/proc/self/status') as fp:
+            for line in fp:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+
+    # kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def top_types(limit=15):
+    """Returns the most common types among objects tracked by the garbage collector."""
+    counts = collections.Counter(type(o).__name__ for o in gc.get_objects())
+    return counts.most_common(limit)
+
+
+def human_size(size, *, truncated=False):
+    if truncated:
+        return f'≥ {human_size(size)}'
+
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GiB'
@@ -0,0 +1,191 @@
+import asyncio
+import datetime
+import logging
+import math
+import time
+
+from aiohttp import web
+
+from utils import memory
+
+log = logging.getLogger(__name__)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Exposition:
+    def __init__(self):
+        self.lines = []
+
+    def metric(self, name, kind, help_text, samples):
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} {kind}')
+        for suffix, labels, value in samples:
+            if labels:
+                labels = ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+                self.lines.append(f'{name}{suffix}{{{labels}}} {value}')
+            else:
+                self.lines.append(f'{name}{suffix} {value}')
+
+    def gauge(self, name, help_text, value):
+        self.metric(name, 'gauge', help_text, [('', None, value)])
+
+    def render(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+class MetricsServer:
+    """Serves Prometheus metrics and health checks over HTTP.
+
+    Meant to be bound to localhost, so that a scraper or supervisor on the
+    same machine can see into the bot without going through Discord.
+
+    ``/metrics`` is in the Prometheus text format. ``/healthz`` fails once
+    the event loop has stopped ticking, and ``/readyz`` fails while the bot
+    is not connected or the database can't be reached.
+
+    Parameters
+    ------------
+    bot: AphidBot
+        The bot to report on.
+    host: str
+        The address to listen on.
+    port: int
+        The port to listen on.
+    stall_after: float
+        How long the loop may go without ticking before it counts as wedged.
+    """
+
+    def __init__(self, bot, *, host='127.0.0.1', port=9100, lag_interval=1.0, stall_after=10.0):
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.lag_interval = lag_interval
+        self.stall_after = stall_after
+        self.loop_lag = 0.0
+        self.last_tick = time.monotonic()
+        self._runner = None
+
+        self._app = web.Application()
+        self._app.router.add_get('/metrics', self.metrics)
+        self._app.router.add_get('/healthz', self.liveness)
+        self._app.router.add_get('/readyz', self.readiness)
+
+        self._tasks = [bot.loop.create_task(self.start()), bot.loop.create_task(self.measure_lag())]
+
+    async def start(self):
+        try:
+            self._runner = web.AppRunner(self._app)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, self.host, self.port).start()
+            log.info(f'Serving metrics on http://{self.host}:{self.port}/metrics')
+        except asyncio.CancelledError:
+            pass
+        except Exception as ex:
+            self.bot.loop.call_exception_handler({'exception': ex})
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def measure_lag(self):
+        try:
+            while True:
+                start = time.monotonic()
+                await asyncio.sleep(self.lag_interval)
+                now = time.monotonic()
+
+                # anything past the interval is time the loop was busy elsewhere
+                self.loop_lag = max(now - start - self.lag_interval, 0.0)
+                self.last_tick = now
+        except asyncio.CancelledError:
+            pass
+
+    async def timer_backlog(self):
+        """Returns how many timers are overdue, or ``None`` if the database didn't answer."""
+        query = "SELECT COUNT(*) FROM timers WHERE expires < (now() at time zone 'utc');"
+        try:
+            return await asyncio.wait_for(self.bot.pool.fetchval(query), 2.0)
+        except (asyncio.TimeoutError, OSError):
+            return None
+        except Exception as ex:
+            log.warning(f'Could not count overdue timers: {type(ex).__name__} - {ex}')
+            return None
+
+    async def metrics(self, request):
+        out = _Exposition()
+
+        latency = self.bot.latency
+        if math.isfinite(latency):
+            out.gauge('aphid_gateway_latency_seconds', 'Time between a gateway heartbeat and its ack.', latency)
+
+        out.gauge('aphid_event_loop_lag_seconds', 'How late the last event loop tick ran.', self.loop_lag)
+        out.gauge('aphid_up', 'Whether the bot is connected and ready.', int(self.bot.is_ready() and not self.bot.is_closed()))
+
+        pool = self.bot.pool
+        if hasattr(pool, 'get_size'):
+            size = pool.get_size()
+            out.gauge('aphid_db_pool_connections', 'Open database connections.', size)
+            out.gauge('aphid_db_pool_checked_out', 'Database connections in use.', size - pool.get_idle_size())
+
+        backlog = await self.timer_backlog()
+        if backlog is not None:
+            out.gauge('aphid_timers_overdue', 'Timers past their expiry that have not run yet.', backlog)
+
+        timers = self.bot.get_cog('Timers')
+        current = getattr(timers, '_current_timer', None)
+        if current is not None:
+            delay = max((datetime.datetime.utcnow() - current.expires).total_seconds(), 0.0)
+            out.gauge('aphid_timer_delay_seconds', 'How far past its expiry the next timer is.', delay)
+
+        entries = []
+        for name, obj in memory.tracked_caches(self.bot):
+            if hasattr(obj, '__len__'):
+                entries.append(('', {'cache': name}, len(obj)))
+        entries.append(('', {'cache': 'discord.users'}, len(self.bot.users)))
+        entries.append(('', {'cache': 'discord.members'}, sum(len(g.members) for g in self.bot.guilds)))
+        out.metric('aphid_cache_entries', 'gauge', 'Entries held by each in-process cache.', entries)
+
+        latencies = []
+        errors = []
+        for (kind, name), histogram in sorted(self.bot.latency_stats.histograms.items()):
+            labels = {'kind': kind, 'handler': name}
+            for q in (50, 95, 99):
+                latencies.append(('', {**labels, 'quantile': q / 100}, histogram.percentile(q)))
+            latencies.append(('_sum', labels, histogram.total))
+            latencies.append(('_count', labels, histogram.count))
+            errors.append(('', labels, histogram.errors))
+
+        out.metric('aphid_handler_latency_seconds', 'summary', 'Time taken by listeners and commands.', latencies)
+        out.metric('aphid_handler_errors_total', 'counter', 'Listener and command runs that raised.', errors)
+
+        return web.Response(text=out.render(), content_type='text/plain', charset='utf-8')
+
+    async def liveness(self, request):
+        stalled = time.monotonic() - self.last_tick
+        if stalled > self.stall_after:
+            return web.Response(status=503, text=f'event loop has not ticked for {stalled:.1f}s\n')
+        return web.Response(text='ok\n')
+
+    async def readiness(self, request):
+        problems = []
+        if self.bot.is_closed():
+            problems.append('closed')
+        elif not self.bot.is_ready():
+            problems.append('not ready')
+        elif not math.isfinite(self.bot.latency):
+            problems.append('no gateway heartbeat')
+
+        try:
+            await asyncio.wait_for(self.bot.pool.fetchval('SELECT 1;'), 2.0)
+        except Exception as ex:
+            problems.append(f'database: {type(ex).__name__}')
+
+        if problems:
+            return web.Response(status=503, text=', '.join(problems) + '\n')
+        return web.Response(text='ready\n')
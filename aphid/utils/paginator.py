@@ -1,4 +1,5 @@
 import asyncio
+import collections
 import inspect
 import itertools
 import re
@@ -10,6 +11,65 @@ class CannotPaginate(Exception):
     pass
 
 
+class PaginatorSessions:
+    """Routes reactions to every open paginator from a single listener.
+
+    Sessions are looked up by message ID, so the cost of a reaction does
+    not depend on how many paginators are open. Idle sessions are expired
+    together by one background sweep instead of a timeout per session.
+
+    Parameters
+    ------------
+    bot: AphidBot
+        The bot to listen to.
+    timeout: float
+        How long a session may go without a reaction before it is closed.
+    """
+
+    def __init__(self, bot, *, timeout=120.0, sweep_interval=10.0):
+        self.bot = bot
+        self.timeout = timeout
+        self.sweep_interval = sweep_interval
+        self._sessions = {}
+        self._task = bot.loop.create_task(self.expire_sessions())
+        bot.add_listener(self.on_reaction_add)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def register(self, pages):
+        self._sessions[pages.message.id] = pages
+
+    def unregister(self, pages):
+        if self._sessions.get(pages.message.id) is pages:
+            del self._sessions[pages.message.id]
+
+    def close(self):
+        self._task.cancel()
+        self.bot.remove_listener(self.on_reaction_add)
+        for pages in self._sessions.values():
+            pages.expire()
+        self._sessions.clear()
+
+    async def on_reaction_add(self, reaction, user):
+        pages = self._sessions.get(reaction.message.id)
+        if pages is not None:
+            pages.feed(reaction, user)
+
+    async def expire_sessions(self):
+        try:
+            while True:
+                await asyncio.sleep(self.sweep_interval)
+
+                cutoff = self.bot.loop.time() - self.timeout
+                expired = [pages for pages in self._sessions.values() if pages.last_active < cutoff]
+                for pages in expired:
+                    self.unregister(pages)
+                    pages.expire()
+        except asyncio.CancelledError:
+            pass
+
+
 class Pages:
     """Implements a paginator that queries the user for the
     pagination interface.
@@ -19,6 +79,10 @@ class Pages:
     If the user does not reply within 2 minutes then the pagination
     interface exits automatically.
 
+    Entries can either be given up front as a list, or fetched lazily
+    a page at a time from an async ``source``. Either way only the most
+    recently viewed pages are kept, already rendered.
+
     Parameters
     ------------
     ctx: Context
@@ -29,6 +93,15 @@ class Pages:
         How many entries show up per page.
     show_entry_count: bool
         Whether to show an entry count in the footer.
+    source: Optional[Callable[[int, int], Awaitable[List[str]]]]
+        A coroutine function taking an offset and a limit and returning
+        the entries in that range. Used instead of ``entries``.
+    count: Optional[Callable[[], Awaitable[int]]]
+        A coroutine function returning the total number of entries for
+        ``source``. Without it the last page is not known up front.
+    cache_size: int
+        How many rendered pages to keep, so flipping back to a recent
+        page doesn't fetch or build it again.
 
     Attributes
     -----------
@@ -39,20 +112,24 @@ class Pages:
     permissions: discord.Permissions
         Our permissions for the channel.
     """
-    def __init__(self, ctx, *, entries, per_page=10, show_entry_count=True):
+    def __init__(self, ctx, *, entries=None, per_page=10, show_entry_count=True, source=None, count=None, cache_size=5):
         self.bot = ctx.bot
         self.entries = entries
+        self.source = source
+        self.count = count
+        self.cache_size = cache_size
         self.message = ctx.message
         self.channel = ctx.channel
         self.author = ctx.author
         self.per_page = per_page
-        pages, left_over = divmod(len(self.entries), self.per_page)
-        if left_over:
-            pages += 1
-        self.maximum_pages = pages
         self.embed = discord.Embed()
-        self.paginating = len(entries) > per_page
         self.show_entry_count = show_entry_count
+        self._rendered = collections.OrderedDict()
+        self._title = discord.Embed.Empty
+        self._edit_task = None
+        self._edit_pending = False
+        self._reaction_task = None
+        self._prepared = source is None
         self.reaction_emojis = [
             ('\N{BLACK LEFT-POINTING DOUBLE TRIANGLE WITH VERTICAL BAR}', self.first_page),
             ('\N{BLACK LEFT-POINTING TRIANGLE}', self.previous_page),
@@ -74,61 +151,188 @@ class Pages:
         if not self.permissions.send_messages:
             raise CannotPaginate('Bot does not have Send Messages permission.')
 
+        if source is None:
+            self.set_total(len(entries))
+        else:
+            # a source is assumed to need paginating until the count says otherwise
+            self.total_entries = None
+            self.maximum_pages = None
+            self.paginating = True
+            if count is None:
+                self.check_pagination_permissions()
+
+    def set_total(self, total):
+        self.total_entries = total
+        pages, left_over = divmod(total, self.per_page)
+        if left_over:
+            pages += 1
+        self.maximum_pages = pages
+        self.paginating = total > self.per_page
+
         if self.paginating:
-            # verify we can actually use the pagination session
-            if not self.permissions.add_reactions:
-                raise CannotPaginate('Bot does not have Add Reactions permission.')
+            self.check_pagination_permissions()
+
+    def check_pagination_permissions(self):
+        # verify we can actually use the pagination session
+        if not self.permissions.add_reactions:
+            raise CannotPaginate('Bot does not have Add Reactions permission.')
+
+        if not self.permissions.read_message_history:
+            raise CannotPaginate('Bot does not have Read Message History permission.')
+
+    async def prepare(self):
+        """Fetches the total from ``count`` if there is one. Called by :meth:`paginate` if needed."""
+        if self._prepared:
+            return
 
-            if not self.permissions.read_message_history:
-                raise CannotPaginate('Bot does not have Read Message History permission.')
+        self._prepared = True
+        if self.count is not None:
+            self.set_total(await self.count())
 
     def get_page(self, page):
         base = (page - 1) * self.per_page
         return self.entries[base:base + self.per_page]
 
-    async def show_page(self, page, *, first=False):
-        self.current_page = page
-        entries = self.get_page(page)
-        # p = []
-        # for index, entry in enumerate(entries, 1 + ((page - 1) * self.per_page)):
-        # p.append(f'{index}. {entry}')
+    async def fetch_page(self, page):
+        if self.source is None:
+            return self.get_page(page)
+
+        entries = await self.source((page - 1) * self.per_page, self.per_page)
+        if len(entries) == 0 and page > 1 and self.maximum_pages is None:
+            # ran off the end of a source without a count
+            self.maximum_pages = page - 1
+            return None
 
-        # self.clear_embed()
+        return entries
+
+    def footer_text(self, page):
+        if self.maximum_pages is None:
+            return f'Page {page}'
+
+        if self.total_entries is None:
+            return f'Page {page}/{self.maximum_pages}'
 
         if self.maximum_pages > 1:
             if self.show_entry_count:
-                text = f'Page {page}/{self.maximum_pages} ({len(self.entries)} entries)'
+                return f'Page {page}/{self.maximum_pages} ({self.total_entries} entries)'
             else:
-                text = f'Page {page}/{self.maximum_pages}'
-            self.embed.set_footer(text=text)
+                return f'Page {page}/{self.maximum_pages}'
         elif self.show_entry_count:
-            text = f'{len(self.entries)} entries'
-            self.embed.set_footer(text=text)
+            return f'{self.total_entries} entries'
+
+        return None
+
+    async def render_page(self, page):
+        """Returns the embed contents for a page, or ``None`` if it is past the end."""
+        entries = await self.fetch_page(page)
+        if entries is None:
+            return None
+
+        return {'description': '\n'.join(entries), 'footer': self.footer_text(page)}
+
+    async def get_rendered_page(self, page):
+        try:
+            rendered = self._rendered[page]
+        except KeyError:
+            rendered = await self.render_page(page)
+            if rendered is None:
+                return None
+
+            self._rendered[page] = rendered
+            while len(self._rendered) > self.cache_size:
+                self._rendered.popitem(last=False)
+        else:
+            self._rendered.move_to_end(page)
+
+        return rendered
+
+    def apply_page(self, rendered):
+        self.embed.title = rendered.get('title', self._title)
+        self.embed.description = rendered['description']
+
+        self.embed.clear_fields()
+        for name, value in rendered.get('fields', ()):
+            self.embed.add_field(name=name, value=value, inline=False)
+
+        if rendered['footer'] is None:
+            self.embed.set_footer()
+        else:
+            self.embed.set_footer(text=rendered['footer'])
+
+        if 'author' in rendered:
+            self.embed.set_author(name=rendered['author'])
+
+    async def show_page(self, page, *, first=False):
+        rendered = await self.get_rendered_page(page)
+        if rendered is None:
+            return
+
+        self.current_page = page
+        self.apply_page(rendered)
 
         if not self.paginating:
-            self.embed.description = '\n'.join(entries)
             return await self.channel.send(embed=self.embed)
 
-        if not first:
-            self.embed.description = '\n'.join(entries)
-            await self.message.edit(embed=self.embed)
-            return
+        if first:
+            return await self.start_session()
+
+        self.request_edit()
+
+    def request_edit(self):
+        # only one edit is in flight at a time, any pages flipped through
+        # while it is are squashed into a single edit showing the latest
+        self._edit_pending = True
+        if self._edit_task is None or self._edit_task.done():
+            self._edit_task = self.bot.loop.create_task(self.send_edits())
+
+    async def send_edits(self):
+        try:
+            while self._edit_pending:
+                self._edit_pending = False
+                await self.message.edit(embed=self.embed)
+        except (asyncio.CancelledError, discord.NotFound):
+            pass
+        except Exception as ex:
+            self.bot.loop.call_exception_handler({'exception': ex})
 
-        # p.append('')
-        # p.append('Confused? React with \N{INFORMATION SOURCE} for more info.')
-        self.embed.description = '\n'.join(entries)
+    async def start_session(self):
         self.message = await self.channel.send(embed=self.embed)
-        for (reaction, _) in self.reaction_emojis:
-            if self.maximum_pages == 2 and reaction in ('\u23ed', '\u23ee'):
-                # no |<< or >>| buttons if we only have two pages
-                # we can't forbid it if someone ends up using it but remove
-                # it from the default set
-                continue
+        self.bot.paginators.register(self)
 
-            await self.message.add_reaction(reaction)
+        # the buttons go on in the background so the first ones can be used
+        # before the rest have been added
+        self._reaction_task = self.bot.loop.create_task(self.add_reactions())
+
+    async def add_reactions(self):
+        try:
+            for (reaction, _) in self.reaction_emojis:
+                if self.maximum_pages == 2 and reaction in ('\u23ed', '\u23ee'):
+                    # no |<< or >>| buttons if we only have two pages
+                    # we can't forbid it if someone ends up using it but remove
+                    # it from the default set
+                    continue
+
+                await self.message.add_reaction(reaction)
+        except (asyncio.CancelledError, discord.NotFound):
+            pass
+        except Exception as ex:
+            self.bot.loop.call_exception_handler({'exception': ex})
+
+    async def remove_reaction(self, reaction, user):
+        try:
+            await self.message.remove_reaction(reaction, user)
+        except Exception:
+            pass  # can't remove it so don't bother doing so
+
+    async def delete_later(self, messages, delay):
+        await asyncio.sleep(delay)
+        try:
+            await self.channel.delete_messages(messages)
+        except Exception:
+            pass
 
     async def checked_show_page(self, page):
-        if page != 0 and page <= self.maximum_pages:
+        if page != 0 and (self.maximum_pages is None or page <= self.maximum_pages):
             await self.show_page(page)
 
     async def first_page(self):
@@ -137,7 +341,8 @@ class Pages:
 
     async def last_page(self):
         """goes to the last page"""
-        await self.show_page(self.maximum_pages)
+        if self.maximum_pages is not None:
+            await self.show_page(self.maximum_pages)
 
     async def next_page(self):
         """goes to the next page"""
@@ -161,24 +366,22 @@ class Pages:
                 self.channel == m.channel and \
                 m.content.isdigit()
 
+        # the prompts are cleaned up in the background rather than holding up the session
+        delay = 5.0
         try:
             msg = await self.bot.wait_for('message', check=message_check, timeout=30.0)
         except asyncio.TimeoutError:
             to_delete.append(await self.channel.send('Took too long.'))
-            await asyncio.sleep(5)
         else:
             page = int(msg.content)
             to_delete.append(msg)
-            if page != 0 and page <= self.maximum_pages:
+            if page != 0 and (self.maximum_pages is None or page <= self.maximum_pages):
                 await self.show_page(page)
+                delay = 0.0
             else:
                 to_delete.append(await self.channel.send(f'Invalid page given. ({page}/{self.maximum_pages})'))
-                await asyncio.sleep(5)
 
-        try:
-            await self.channel.delete_messages(to_delete)
-        except Exception:
-            pass
+        self.bot.loop.create_task(self.delete_later(to_delete, delay))
 
     async def show_help(self):
         """shows this message"""
@@ -192,7 +395,7 @@ class Pages:
         self.embed.add_field(name='What are these reactions for?', value='\n'.join(messages), inline=False)
 
         self.embed.set_footer(text=f'We were on page {self.current_page} before this message.')
-        await self.message.edit(embed=self.embed)
+        self.request_edit()
 
         async def go_back_to_current_page():
             await asyncio.sleep(30.0)
@@ -205,18 +408,20 @@ class Pages:
         await self.message.delete()
         self.paginating = False
 
-    def react_check(self, reaction, user):
+    def feed(self, reaction, user):
+        """Called by :class:`PaginatorSessions` with a reaction on our message."""
         if user is None or user.id != self.author.id:
-            return False
+            return
 
-        if reaction.message.id != self.message.id:
-            return False
+        func = self._emoji_map.get(reaction.emoji)
+        if func is None:
+            return
 
-        for (emoji, func) in self.reaction_emojis:
-            if reaction.emoji == emoji:
-                self.match = func
-                return True
-        return False
+        self.last_active = self.bot.loop.time()
+        self._reactions.put_nowait((func, reaction, user))
+
+    def expire(self):
+        self._reactions.put_nowait(None)
 
     def clear_embed(self):
         self.embed.title = discord.Embed.Empty
@@ -226,73 +431,47 @@ class Pages:
 
     async def paginate(self):
         """Actually paginate the entries and run the interactive loop if necessary."""
-        first_page = self.show_page(1, first=True)
-        if not self.paginating:
-            await first_page
-        else:
-            # allow us to react to reactions right away if we're paginating
-            self.bot.loop.create_task(first_page)
-
-        while self.paginating:
-            try:
-                reaction, user = await self.bot.wait_for('reaction_add', check=self.react_check, timeout=120.0)
-            except asyncio.TimeoutError:
-                self.paginating = False
-                try:
-                    await self.message.clear_reactions()
-                except Exception:
-                    pass
-                finally:
-                    break
+        await self.prepare()
+
+        self._title = self.embed.title
+        self._emoji_map = dict(self.reaction_emojis)
+        self._reactions = asyncio.Queue(loop=self.bot.loop)
+        self.last_active = self.bot.loop.time()
 
-            try:
-                await self.message.remove_reaction(reaction, user)
-            except Exception:
-                pass  # can't remove it so don't bother doing so
+        await self.show_page(1, first=True)
 
-            await self.match()
+        try:
+            while self.paginating:
+                item = await self._reactions.get()
+                if item is None:
+                    # timed out, see PaginatorSessions.expire_sessions
+                    self.paginating = False
+                    self._reaction_task.cancel()
+                    try:
+                        await self.message.clear_reactions()
+                    except Exception:
+                        pass
+                    break
+
+                func, reaction, user = item
+                self.bot.loop.create_task(self.remove_reaction(reaction, user))
+                await func()
+        finally:
+            if self._reaction_task is not None:
+                self._reaction_task.cancel()
+            self.bot.paginators.unregister(self)
 
 
 class FieldPages(Pages):
     """Similar to Pages except entries should be a list of
     tuples having (key, value) to show as embed fields instead.
     """
-    async def show_page(self, page, *, first=False):
-        self.current_page = page
-        entries = self.get_page(page)
-
-        self.clear_embed()
-
-        for key, value in entries:
-            self.embed.add_field(name=key, value=value, inline=False)
-
-        text = None
-        if self.maximum_pages > 1:
-            if self.show_entry_count:
-                text = f'Page {page}/{self.maximum_pages} ({len(self.entries)} entries)'
-            else:
-                text = f'Page {page}/{self.maximum_pages}'
-        elif self.show_entry_count:
-            text = f'{len(self.entries)} entries'
+    async def render_page(self, page):
+        entries = await self.fetch_page(page)
+        if entries is None:
+            return None
 
-        self.embed.set_footer(text=text)
-
-        if not self.paginating:
-            return await self.channel.send(embed=self.embed)
-
-        if not first:
-            await self.message.edit(embed=self.embed)
-            return
-
-        self.message = await self.channel.send(embed=self.embed)
-        for (reaction, _) in self.reaction_emojis:
-            if self.maximum_pages == 2 and reaction in ('\u23ed', '\u23ee'):
-                # no |<< or >>| buttons if we only have two pages
-                # we can't forbid it if someone ends up using it but remove
-                # it from the default set
-                continue
-
-            await self.message.add_reaction(reaction)
+        return {'description': discord.Embed.Empty, 'fields': list(entries), 'footer': self.footer_text(page)}
 
 
 # ?help
@@ -350,13 +529,87 @@ def _command_signature(cmd):
 
 
 class HelpPaginator(Pages):
+    # built help keyed by permission profile, prefix and what was asked for,
+    # emptied by the Owner commands whenever extensions change
+    _cache = collections.OrderedDict()
+    _cache_size = 256
+    _generation = 0
+
     def __init__(self, ctx, entries, *, per_page=4):
         super().__init__(ctx, entries=entries, per_page=per_page)
         self.reaction_emojis.append(('\N{WHITE QUESTION MARK ORNAMENT}', self.show_bot_help))
         self.total = len(entries)
+        self.title = None
+        self.description = None
+        self._is_bot = False
+
+    @classmethod
+    def invalidate(cls):
+        """Forgets all built help, to be called when commands are added or removed."""
+        cls._cache.clear()
+        cls._generation += 1
+
+    @staticmethod
+    async def permission_profile(ctx):
+        """Returns a key for everything deciding which commands ``ctx`` can run."""
+        roles = None
+        permissions = None
+        if ctx.guild is not None:
+            roles = frozenset(role.id for role in ctx.author.roles)
+            permissions = ctx.channel.permissions_for(ctx.guild.me).value
+
+        return (await ctx.bot.is_owner(ctx.author), roles, permissions)
+
+    @classmethod
+    async def cached(cls, ctx, name, build, *args):
+        key = (await cls.permission_profile(ctx), cleanup_prefix(ctx.bot, ctx.prefix), name)
+        try:
+            template = cls._cache[key]
+        except KeyError:
+            generation = cls._generation
+            template = await build(ctx, *args)
+            # pages are never evicted so every paginator sharing them renders each once
+            template.cache_size = max(template.maximum_pages, 1)
+
+            # don't keep help that was built while extensions were being changed
+            if generation == cls._generation:
+                cls._cache[key] = template
+                while len(cls._cache) > cls._cache_size:
+                    cls._cache.popitem(last=False)
+        else:
+            cls._cache.move_to_end(key)
+
+        return template.copy(ctx)
+
+    def copy(self, ctx):
+        other = type(self)(ctx, self.entries, per_page=self.per_page)
+        other.title = self.title
+        other.description = self.description
+        other.prefix = self.prefix
+        other.total = self.total
+
+        if self._is_bot:
+            other.get_page = other.get_bot_page
+            other._is_bot = True
+
+        other._rendered = self._rendered
+        other.cache_size = self.cache_size
+        return other
 
     @classmethod
     async def from_cog(cls, ctx, cog):
+        return await cls.cached(ctx, ('cog', cog.__class__.__name__), cls._from_cog, cog)
+
+    @classmethod
+    async def from_command(cls, ctx, command):
+        return await cls.cached(ctx, ('command', command.qualified_name), cls._from_command, command)
+
+    @classmethod
+    async def from_bot(cls, ctx):
+        return await cls.cached(ctx, ('bot',), cls._from_bot)
+
+    @classmethod
+    async def _from_cog(cls, ctx, cog):
         cog_name = cog.__class__.__name__
 
         # get the commands
@@ -373,7 +626,7 @@ class HelpPaginator(Pages):
         return self
 
     @classmethod
-    async def from_command(cls, ctx, command):
+    async def _from_command(cls, ctx, command):
         try:
             entries = sorted(command.commands, key=lambda c: c.name)
         except AttributeError:
@@ -393,7 +646,7 @@ class HelpPaginator(Pages):
         return self
 
     @classmethod
-    async def from_bot(cls, ctx):
+    async def _from_bot(cls, ctx):
         def key(c):
             return c.cog_name or '\u200bMisc'
 
@@ -435,41 +688,20 @@ class HelpPaginator(Pages):
         self.description = description
         return commands
 
-    async def show_page(self, page, *, first=False):
-        self.current_page = page
+    async def render_page(self, page):
         entries = self.get_page(page)
 
-        self.clear_embed()
-
-        self.embed.description = self.description
-        self.embed.title = self.title
-
-        self.embed.set_footer(text=f'Use "{self.prefix}help command" for more info on a command.')
-
-        signature = _command_signature
-
-        for entry in entries:
-            self.embed.add_field(name=signature(entry), value=entry.short_doc or "No help given", inline=False)
+        rendered = {
+            'title': self.title,
+            'description': self.description,
+            'fields': [(_command_signature(entry), entry.short_doc or 'No help given') for entry in entries],
+            'footer': f'Use "{self.prefix}help command" for more info on a command.',
+        }
 
         if self.maximum_pages:
-            self.embed.set_author(name=f'Page {page}/{self.maximum_pages} ({self.total} commands)')
-
-        if not self.paginating:
-            return await self.channel.send(embed=self.embed)
-
-        if not first:
-            await self.message.edit(embed=self.embed)
-            return
-
-        self.message = await self.channel.send(embed=self.embed)
-        for (reaction, _) in self.reaction_emojis:
-            if self.maximum_pages == 2 and reaction in ('\u23ed', '\u23ee'):
-                # no |<< or >>| buttons if we only have two pages
-                # we can't forbid it if someone ends up using it but remove
-                # it from the default set
-                continue
+            rendered['author'] = f'Page {page}/{self.maximum_pages} ({self.total} commands)'
 
-            await self.message.add_reaction(reaction)
+        return rendered
 
     async def show_bot_help(self):
         """shows how to use the bot"""
@@ -494,7 +726,7 @@ class HelpPaginator(Pages):
             self.embed.add_field(name=name, value=value, inline=False)
 
         self.embed.set_footer(text=f'We were on page {self.current_page} before this message.')
-        await self.message.edit(embed=self.embed)
+        self.request_edit()
 
         async def go_back_to_current_page():
             await asyncio.sleep(30.0)
@@ -0,0 +1,79 @@
+import collections
+import sys
+import time
+
+
+class StackSampler:
+    """Samples a thread's stack from another thread.
+
+    Each sample walks the target thread's current frame, so the cost to
+    the sampled thread is only the GIL being held for the walk. Samples
+    are aggregated as collapsed stacks, one ``frame;frame;frame count``
+    line per distinct stack, which flame graph tools read directly.
+
+    Parameters
+    ------------
+    thread_id: int
+        The ident of the thread to sample.
+    interval: float
+        How long to wait between samples, in seconds.
+    tags: Dict[code, str]
+        Code objects to label stacks by. The outermost frame running one
+        of them is added as the root of the stack.
+    """
+
+    def __init__(self, thread_id, *, interval=0.005, tags=None):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.tags = tags or {}
+        self.samples = collections.Counter()
+        self.count = 0
+
+    @staticmethod
+    def bot_tags(bot):
+        """Returns tags for every command callback and cog listener of the bot."""
+        tags = {}
+        for command in bot.walk_commands():
+            tags[command.callback.__code__] = f'command:{command.qualified_name}'
+
+        for event, listeners in bot.extra_events.items():
+            for listener in listeners:
+                func = getattr(listener, '__func__', listener)
+                owner = getattr(listener, '__self__', None)
+                name = type(owner).__name__ if owner is not None else func.__module__
+                tags[func.__code__] = f'listener:{name}.{event}'
+
+        return tags
+
+    def run(self, duration):
+        """Samples for ``duration`` seconds. Blocks, so run it in another thread."""
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+
+            self.samples[self.collapse(frame)] += 1
+            self.count += 1
+            del frame
+
+            time.sleep(self.interval)
+
+    def collapse(self, frame):
+        names = []
+        tag = None
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{frame.f_globals.get("__name__", "?")}:{getattr(code, "co_qualname", code.co_name)}')
+            # walking outwards, so the last match is the outermost one
+            tag = self.tags.get(code, tag)
+            frame = frame.f_back
+
+        if tag is not None:
+            names.append(tag)
+
+        names.reverse()
+        return ';'.join(names)
+
+    def render(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.samples.most_common())
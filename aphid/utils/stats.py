@@ -0,0 +1,96 @@
+import array
+import json
+import math
+import os
+
+
+class LatencyHistogram:
+    """A fixed size histogram of durations.
+
+    Durations fall into buckets growing by ``factor`` from ``minimum`` up,
+    so memory does not grow with the number of samples and percentiles
+    are accurate to within a bucket.
+
+    Parameters
+    ------------
+    minimum: float
+        The upper bound of the first bucket, in seconds.
+    factor: float
+        How much bigger each bucket is than the one before it.
+    buckets: int
+        How many buckets to keep. Anything past the last lands in it.
+    """
+
+    __slots__ = ('minimum', 'factor', 'counts', 'count', 'errors', 'total', 'max')
+
+    def __init__(self, *, minimum=0.0001, factor=1.25, buckets=64):
+        self.minimum = minimum
+        self.factor = factor
+        self.counts = array.array('I', bytes(4 * buckets))
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, duration, *, error=False):
+        if duration <= self.minimum:
+            index = 0
+        else:
+            index = min(int(math.log(duration / self.minimum, self.factor)) + 1, len(self.counts) - 1)
+
+        self.counts[index] += 1
+        self.count += 1
+        self.total += duration
+        if error:
+            self.errors += 1
+        if duration > self.max:
+            self.max = duration
+
+    def percentile(self, q):
+        """Returns the upper bound of the bucket holding the ``q``th percentile, in seconds."""
+        if self.count == 0:
+            return 0.0
+
+        rank = math.ceil(q / 100 * self.count)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.minimum * self.factor ** index, self.max)
+
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+class LatencyStats:
+    """Latency histograms for every listener and command, keyed by kind and name."""
+
+    def __init__(self):
+        self.histograms = {}
+
+    def record(self, kind, name, duration, *, error=False):
+        key = (kind, name)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = LatencyHistogram()
+        histogram.record(duration, error=error)
+
+    def snapshot(self):
+        return {f'{kind}:{name}': histogram.to_dict() for (kind, name), histogram in sorted(self.histograms.items())}
+
+    def write(self, path):
+        # written beside and moved into place so readers never see half a file
+        temp = f'{path}.tmp'
+        with open(temp, 'w', encoding='utf-8') as fp:
+            json.dump(self.snapshot(), fp, indent=2)
+        os.replace(temp, path)
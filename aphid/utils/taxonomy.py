@@ -0,0 +1,144 @@
+import array
+import os
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'taxonomy.txt')
+
+
+def _bigrams(word):
+    word = f'^{word}$'
+    return {word[i:i + 2] for i in range(len(word) - 1)}
+
+
+def _distance(a, b, limit):
+    """Levenshtein distance between two strings, giving up once it passes ``limit``."""
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+
+    return previous[-1]
+
+
+class TaxonomyIndex:
+    """A sorted, read-only index of taxon names.
+
+    Names are held lowercased in one newline separated ``bytes`` blob with
+    an ``array`` of offsets into it, rather than as a list of ``str``
+    objects, and are searched with a binary search.
+
+    Parameters
+    ------------
+    names: Iterable[str]
+        Names in the form ``Genus [species [subspecies]]``.
+    """
+
+    def __init__(self, names):
+        names = sorted({' '.join(name.lower().split()) for name in names if name.strip()})
+        self._blob = '\n'.join(names).encode('utf-8')
+        self._offsets = array.array('I', [0])
+        for name in names:
+            self._offsets.append(self._offsets[-1] + len(name.encode('utf-8')) + 1)
+
+        # bigrams of the last part of each name, so fuzzy lookups only run
+        # the edit distance on names that share enough of them
+        grams = {}
+        for i, name in enumerate(names):
+            for gram in _bigrams(name.rpartition(' ')[2]):
+                grams.setdefault(gram, []).append(i)
+        self._grams = {gram: array.array('I', indices) for gram, indices in grams.items()}
+
+    @classmethod
+    def from_file(cls, path=DATA_FILE):
+        with open(path, 'r', encoding='utf-8') as fp:
+            return cls(line for line in fp if not line.startswith('#'))
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __contains__(self, name):
+        name = ' '.join(name.lower().split())
+        index = self._bisect(name)
+        return index < len(self) and self._name(index) == name
+
+    def _name(self, index):
+        return self._blob[self._offsets[index]:self._offsets[index + 1] - 1].decode('utf-8')
+
+    def _bisect(self, name):
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._name(mid) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _range(self, prefix):
+        start = self._bisect(prefix)
+        end = self._bisect(prefix + '\uffff')
+        return start, end
+
+    def prefix(self, prefix, *, limit=10):
+        """Returns names starting with ``prefix``, in sorted order."""
+        start, end = self._range(' '.join(prefix.lower().split()))
+        return [self._name(i) for i in range(start, min(end, start + limit))]
+
+    def suggest(self, name, *, limit=3, max_distance=2):
+        """Returns the names closest to a name that isn't in the index.
+
+        Only names at the same rank are considered, and for a species or
+        subspecies only those within the same genus or species.
+        """
+        parts = name.lower().split()
+        parent = ' '.join(parts[:-1])
+        if parent and parent not in self:
+            return []
+
+        if parent:
+            start, end = self._range(parent + ' ')
+        else:
+            start, end = 0, len(self)
+
+        target = parts[-1]
+        depth = len(parts) - 1
+        grams = _bigrams(target)
+
+        # two names within n edits share at least this many bigrams
+        needed = len(grams) - 2 * max_distance
+        if needed > 0:
+            counts = {}
+            for gram in grams:
+                for i in self._grams.get(gram, ()):
+                    if start <= i < end:
+                        counts[i] = counts.get(i, 0) + 1
+            candidates = [i for i, count in counts.items() if count >= needed]
+        else:
+            candidates = range(start, end)
+
+        scored = []
+        for i in candidates:
+            candidate = self._name(i)
+            if candidate.count(' ') != depth:
+                continue
+
+            # only the last part can differ, the rest is the shared prefix
+            last = candidate.rpartition(' ')[2]
+            if abs(len(last) - len(target)) > max_distance:
+                continue
+
+            distance = _distance(target, last, max_distance)
+            if distance <= max_distance:
+                scored.append((distance, candidate))
+
+        scored.sort()
+        return [candidate for _, candidate in scored[:limit]]
+
+    @staticmethod
+    def display(name):
+        genus, _, rest = name.partition(' ')
+        return f'{genus.capitalize()} {rest}'.strip()